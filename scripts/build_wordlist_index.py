@@ -0,0 +1,38 @@
+"""
+Compile the packaged wordlists into binary indexes and the unicode tables
+used to segment them. Run this before building a release so they're
+shipped in the wheel.
+"""
+from diffenator2.wordlist import compile_wordlist
+from diffenator2.segmenting import compile_unicode_tables, UNICODE_TABLES
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+import os
+
+
+# The wordlists in this checkout, not an installed copy of the package
+WORDLISTS = os.path.join(
+    os.path.dirname(__file__), "..", "src", "diffenator2", "data", "wordlists"
+)
+
+
+def main(files=None, jobs=None):
+    # Tables from the installed package are only written to this checkout
+    compile_unicode_tables(
+        os.path.join(os.path.dirname(WORDLISTS), os.path.basename(UNICODE_TABLES))
+    )
+    if not files:
+        files = sorted(glob(os.path.join(WORDLISTS, "*.txt")))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for fp, _ in zip(files, executor.map(compile_wordlist, files)):
+            print(f"Compiled {fp}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile wordlist indexes")
+    parser.add_argument("files", metavar="FILE", nargs="*")
+    parser.add_argument("--jobs", type=int, default=None)
+    args = parser.parse_args()
+    main(args.files, args.jobs)
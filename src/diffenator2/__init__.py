@@ -3,10 +3,19 @@ import logging
 import os
 from ninja.ninja_syntax import Writer
 from diffenator2.renderer import FONT_SIZE
-from diffenator2.utils import dict_coords_to_string, partition, resource_filename
+from diffenator2.utils import (
+    dict_coords_to_string,
+    partition,
+    resource_filename,
+    content_hash,
+    stamp_is_valid,
+)
 from diffenator2.font import DFont, get_font_styles
 from diffenator2.matcher import FontMatcher
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import shutil
+import types
+import tqdm
 import ninja
 
 
@@ -15,72 +24,193 @@ logger.setLevel(logging.INFO)
 
 
 MAX_STYLES = 1
-THRESHOLD = 0.90  # Percent difference
+# Percentage the inked pixels of a glyph or word must change by to be
+# reported, see PixelDiffer.diff
+THRESHOLD = 0.5
 NINJA_BUILD_FILE = "build.ninja"
+# Build state is kept in the out dir so unchanged styles aren't rebuilt
+STAMP_DIR = ".diffenator2"
 
 
 class NinjaBuilder:
-    NINJA_LOG_FILE = ".ninja_log"
     NINJA_BUILD_FILE = "build.ninja"
+    FONT_ARGS = ("fonts", "fonts_before", "fonts_after", "old_font", "new_font")
+    TEMPLATE_ARGS = ("diffenator_template", "diffbrowsers_templates", "user_wordlist")
+    # options which don't change the reports, so shouldn't cause a rebuild
+    SCHEDULING_ARGS = ("jobs", "ninja_jobs", "executor", "cache_dir")
+    RULES = {
+        "proofing": "_diffbrowsers",
+        "diffbrowsers": "_diffbrowsers",
+        "diffenator": "_diffenator",
+    }
 
-    def __init__(self, cli_args):
+    def __init__(self, cli_args, jobs=None):
         self.cli_args = cli_args
+        self.jobs = jobs
         self.ninja_file = open(NINJA_BUILD_FILE, "w", encoding="utf8")
         self.w = Writer(self.ninja_file)
+        self.w.variable("builddir", cli_args["out"])
+        self.w.newline()
+        self.rules = set()
+        self.outputs = set()
 
     def run(self):
+        """Run every style in a single ninja build so they run in parallel"""
         self.w.close()
-        ninja._program("ninja", [])
+        args = [] if self.jobs is None else ["-j", str(self.jobs)]
+        ninja._program("ninja", args)
 
-    def proof_fonts(self):
-        self.ninja_file = open(NINJA_BUILD_FILE, "w", encoding="utf8")
-        self.w = Writer(self.ninja_file)
-        self.w.rule("proofing", '_diffbrowsers "$args"')
+    def _rule(self, name):
+        if name in self.rules:
+            return
+        self.w.rule(name, f'{self.RULES[name]} "$args"')
         self.w.newline()
-        self.w.build(self.cli_args["out"], "proofing", variables={"args": repr(self.cli_args)})
-        self.run()
-        self.w.close()
-        self.ninja_file.close()
+        self.rules.add(name)
 
-    def diff_fonts(self, fonts_before, fonts_after):
-        self.ninja_file = open(NINJA_BUILD_FILE, "w", encoding="utf8")
-        self.w = Writer(self.ninja_file)
-        if self.cli_args["diffbrowsers"]:
-            self.w.rule("diffbrowsers", '_diffbrowsers "$args"')
-            self.w.build(self.cli_args["out"], "diffbrowsers", variables={"args": repr(self.cli_args)})
-        self.w.newline()
+    def _input_files(self, args):
+        """Files whose contents determine the output of a build edge,
+        including diffenator2's own source so upgrading it rebuilds"""
+        files = []
+        font_args = self.FONT_ARGS
+        if "old_font" in args:
+            # diffenator edges only read a single pair of fonts
+            font_args = ("old_font", "new_font")
+        for k in font_args + self.TEMPLATE_ARGS:
+            v = args.get(k)
+            if not v:
+                continue
+            files += [v] if isinstance(v, str) else v
+        templates_dir = resource_filename("diffenator2", "templates")
+        files += sorted(
+            os.path.join(templates_dir, f) for f in os.listdir(templates_dir)
+        )
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        files += sorted(
+            os.path.join(package_dir, f)
+            for f in os.listdir(package_dir)
+            if f.endswith(".py")
+        )
+        return [os.path.abspath(f) for f in files]
+
+    def _build(self, name, rule, args):
+        # styles are partitioned using regexes, which may match the same
+        # style more than once
+        if (rule, name) in self.outputs:
+            return
+        self.outputs.add((rule, name))
+        # The edge's output is a stamp named after a hash of its inputs. If
+        # the fonts, coords, templates, options and diffenator2 itself haven't
+        # changed since the last run, ninja finds the stamp and skips the
+        # edge. A stamp whose reports have been deleted is removed so they're
+        # written again.
+        stamp_dir = os.path.join(self.cli_args["out"], STAMP_DIR)
+        key = content_hash(
+            sorted(i for i in args.items() if i[0] not in self.SCHEDULING_ARGS),
+            self._input_files(args),
+        )
+        prefix = f"{rule}-{name.replace('|', '-')}."
+        output = os.path.join(stamp_dir, f"{prefix}{key[:16]}")
+        if os.path.isdir(stamp_dir):
+            for f in os.listdir(stamp_dir):
+                if f.startswith(prefix) and os.path.join(stamp_dir, f) != output:
+                    os.remove(os.path.join(stamp_dir, f))
+        if os.path.exists(output) and not stamp_is_valid(output):
+            os.remove(output)
+        self._edge(output, rule, {**args, "stamp": output})
 
-        if self.cli_args["diffenator"]:
-            self.w.rule("diffenator", '_diffenator "$args"')
+    def _edge(self, output, rule, args):
+        self._rule(rule)
+        self.w.build(output, rule, variables={"args": repr(args)})
+
+    def proof_fonts(self, filter_styles):
+        self._build(
+            filter_styles,
+            "proofing",
+            {**self.cli_args, "filter_styles": filter_styles},
+        )
+
+    def diff_fonts(self, fonts_before, fonts_after, filter_styles):
+        cli_args = {**self.cli_args, "filter_styles": filter_styles}
+        if cli_args["diffbrowsers"]:
+            self._build(filter_styles, "diffbrowsers", cli_args)
+
+        if cli_args["diffenator"]:
             matcher = FontMatcher(fonts_before, fonts_after)
 
-            getattr(matcher, self.cli_args["styles"])(self.cli_args["filter_styles"])
+            getattr(matcher, cli_args["styles"])(filter_styles)
             for old_style, new_style in zip(matcher.old_styles, matcher.new_styles):
                 coords = new_style.coords
                 style = new_style.name.replace(" ", "-")
-                o = os.path.join(self.cli_args["out"], style.replace(" ", "-"))
-                self.w.build(o, "diffenator", variables={"args": repr(
-                    {**self.cli_args, **{
+                self._build(style, "diffenator", {
+                    **cli_args, **{
                         "coords": dict_coords_to_string(coords),
-                        "old_font": old_style.font.ttFont.reader.file.name,
-                        "new_font": new_style.font.ttFont.reader.file.name,
-                        "out": self.cli_args["out"],
-                    }}
-                )})
-        self.run()
-        self.w.close()
-        self.ninja_file.close()
+                        "old_font": old_style.font.path,
+                        "new_font": new_style.font.path,
+                        "out": cli_args["out"],
+                    }
+                })
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        # rm ninja cache files so we can rerun the tool
+        # The build log lives in the out dir ($builddir) and is kept so the
+        # next run can skip styles whose inputs haven't changed
         self.ninja_file.close()
         if os.path.exists(self.NINJA_BUILD_FILE):
             os.remove(self.NINJA_BUILD_FILE)
-        if os.path.exists(self.NINJA_LOG_FILE):
-            os.remove(self.NINJA_LOG_FILE)
+
+
+# Fonts loaded by an InProcessBuilder worker, reused between edges
+_worker_fonts = {}
+
+
+def _run_edge(rule, args):
+    if rule == "diffenator":
+        from diffenator2._diffenator import run
+    else:
+        from diffenator2._diffbrowsers import run
+    run(types.SimpleNamespace(**args), fonts=_worker_fonts)
+
+
+class InProcessBuilder(NinjaBuilder):
+    """Runs the same build edges as NinjaBuilder in a pool of long-lived
+    worker processes instead of a new Python process per edge. Workers
+    keep the fonts they've loaded so styles which share a font file only
+    parse it once."""
+
+    def __init__(self, cli_args, jobs=None):
+        self.cli_args = cli_args
+        self.jobs = jobs
+        self.rules = set()
+        self.outputs = set()
+        self.edges = []
+
+    def _edge(self, output, rule, args):
+        # same as ninja, an edge is up to date if its stamp exists
+        if not os.path.exists(output):
+            self.edges.append((output, rule, args))
+
+    def run(self):
+        if not self.edges:
+            return
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {
+                executor.submit(_run_edge, rule, args): output
+                for output, rule, args in self.edges
+            }
+            for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+                # Like ninja, keep building the other styles if one fails
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception("FAILED: %s", futures[future])
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+EXECUTORS = {"ninja": NinjaBuilder, "inprocess": InProcessBuilder}
 
 
 def ninja_proof(
@@ -93,6 +223,8 @@ def ninja_proof(
     command="proof",
     user_wordlist: str = "",
     diffbrowsers_templates=[],
+    ninja_jobs: int = None,
+    executor: str = "ninja",
     **kwargs
 ):
     if not os.path.exists(out):
@@ -103,18 +235,14 @@ def ninja_proof(
         **locals().pop("kwargs"),
         **{"fonts": [f.path for f in fonts]}
     }
-    with NinjaBuilder(cli_args=args) as builder:
+    with EXECUTORS[executor](cli_args=args, jobs=ninja_jobs) as builder:
         if filter_styles:
-            builder.proof_fonts()
-            return
-
-        font_styles = get_font_styles(fonts, styles)
-        partitioned = partition(font_styles, MAX_STYLES)
-        for font_styles in partitioned:
-            filter_styles = "|".join(s.name for s in font_styles)
-            builder.cli_args["out"] = out
-            builder.cli_args["filter_styles"] = filter_styles
-            builder.proof_fonts()
+            builder.proof_fonts(filter_styles)
+        else:
+            font_styles = get_font_styles(fonts, styles)
+            for p in partition(font_styles, MAX_STYLES):
+                builder.proof_fonts("|".join(s.name for s in p))
+        builder.run()
 
 
 def ninja_diff(
@@ -134,12 +262,18 @@ def ninja_diff(
     precision: int = FONT_SIZE,
     no_words: bool = False,
     no_tables: bool = False,
+    only_changed_words: bool = False,
     diffenator_template = resource_filename(
         "diffenator2", os.path.join("templates", "diffenator.html")
     ),
     command="diff",
     diffbrowsers_templates=[],
     debug_gifs: bool = False,
+    renderer: str = None,
+    jobs: int = 1,
+    ninja_jobs: int = None,
+    executor: str = "ninja",
+    cache_dir: str = None,
     **kwargs
 ):
     args = {
@@ -151,24 +285,23 @@ def ninja_diff(
     if not os.path.exists(out):
         os.mkdir(out)
 
-    with NinjaBuilder(cli_args=args) as builder:
+    with EXECUTORS[executor](cli_args=args, jobs=ninja_jobs) as builder:
         if filter_styles:
-            builder.diff_fonts(fonts_before, fonts_after)
+            builder.diff_fonts(fonts_before, fonts_after, filter_styles)
+            builder.run()
             return
 
-    matcher = FontMatcher(fonts_before, fonts_after)
-    getattr(matcher, styles)()
-    if not matcher.old_styles and not matcher.new_styles:
-        raise ValueError(
-            f"Matcher was not able to detect any matching styles for {styles} "
-            "method.\nPlease ensure that variable fonts have fvar instances, "
-            "both fonts have designspaces which overlap or ensure that both "
-            "sets of static fonts have some matching styles."
-        )
+        matcher = FontMatcher(fonts_before, fonts_after)
+        getattr(matcher, styles)()
+        if not matcher.old_styles and not matcher.new_styles:
+            raise ValueError(
+                f"Matcher was not able to detect any matching styles for {styles} "
+                "method.\nPlease ensure that variable fonts have fvar instances, "
+                "both fonts have designspaces which overlap or ensure that both "
+                "sets of static fonts have some matching styles."
+            )
 
-    partitioned = partition(matcher.old_styles, MAX_STYLES)
-    for p in partitioned:
-        filter_styles = "|".join(style.name for style in p)
-        builder.cli_args["out"] = out
-        builder.cli_args["filter_styles"] = filter_styles
-        builder.diff_fonts(fonts_before, fonts_after)
+        for p in partition(matcher.old_styles, MAX_STYLES):
+            filter_styles = "|".join(style.name for style in p)
+            builder.diff_fonts(fonts_before, fonts_after, filter_styles)
+        builder.run()
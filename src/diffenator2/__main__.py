@@ -5,7 +5,7 @@ import os
 from diffenator2 import ninja_diff, ninja_proof, THRESHOLD, NINJA_BUILD_FILE
 from diffenator2.font import DFont
 from diffenator2.html import build_index_page
-from diffenator2.renderer import FONT_SIZE
+from diffenator2.renderer import FONT_SIZE, RENDERERS
 from diffenator2.utils import resource_filename
 from glob import glob
 
@@ -39,6 +39,20 @@ def main(**kwargs):
         universal_options_parser.add_argument(
             "--diffbrowsers-templates", nargs="+", default=[]
         )
+        universal_options_parser.add_argument(
+            "--ninja-jobs",
+            type=int,
+            default=None,
+            help="Number of styles to process in parallel (ninja's -j). "
+            "Defaults to ninja's own choice",
+        )
+        universal_options_parser.add_argument(
+            "--executor",
+            choices=("ninja", "inprocess"),
+            default="ninja",
+            help="Run each style in a new ninja subprocess or in a pool of "
+            "worker processes which reuse loaded fonts",
+        )
         proof_parser = subparsers.add_parser(
             "proof",
             parents=[universal_options_parser],
@@ -68,9 +82,33 @@ def main(**kwargs):
         diff_parser.add_argument(
             "--no-words", action="store_true", help="Skip diffing wordlists"
         )
+        diff_parser.add_argument(
+            "--only-changed-words",
+            action="store_true",
+            help="Only diff words which contain a glyph whose outline or "
+            "GSUB/GPOS rules have changed",
+        )
         diff_parser.add_argument(
             "--debug-gifs", action="store_true", help="Generate debug gifs"
         )
+        diff_parser.add_argument(
+            "--renderer",
+            choices=RENDERERS,
+            default=None,
+            help="Glyph renderer. Defaults to freetype unless the fonts have color tables",
+        )
+        diff_parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of processes used to diff the glyphs and words of each style",
+        )
+        diff_parser.add_argument(
+            "--cache-dir",
+            default=None,
+            help="Keep rendered glyphs in a cache in this dir so they're "
+            "reused by later runs",
+        )
         parser.add_argument(
             "--diffenator-template",
             default=resource_filename(
@@ -3,7 +3,7 @@ from __future__ import annotations
 from diffenator2.html import proof_rendering, diff_rendering
 from diffenator2.font import DFont, get_font_styles
 from diffenator2.matcher import FontMatcher
-from diffenator2.utils import re_filter_characters, resource_filename
+from diffenator2.utils import re_filter_characters, resource_filename, write_stamp
 from glob import glob
 import os
 import sys
@@ -29,19 +29,27 @@ def _get_diffbrowser_templates(user_templates, out):
     return glob(os.path.join(out, "diffbrowsers*.html"))
 
 
-def main():
-    # Maybe json load/dump is better
-    args = types.SimpleNamespace(**ast.literal_eval(sys.argv[1]))
+def _load_font(fp, suffix, fonts):
+    key = (os.path.abspath(fp), suffix)
+    if fonts is None:
+        return DFont(key[0], suffix=suffix)
+    if key not in fonts:
+        fonts[key] = DFont(key[0], suffix=suffix)
+    return fonts[key]
 
+
+def run(args, fonts=None):
+    """Render the diffbrowsers pages for some styles. fonts is an optional
+    dict used to reuse fonts between runs"""
     with tempfile.TemporaryDirectory() as tmp_dir:
         templates = _get_diffbrowser_templates(args.diffbrowsers_templates, tmp_dir)
 
         if args.command == "proof":
-            fonts = [DFont(os.path.abspath(fp)) for fp in args.fonts]
-            styles = get_font_styles(fonts, args.styles, args.filter_styles)
+            dfonts = [_load_font(fp, "", fonts) for fp in args.fonts]
+            styles = get_font_styles(dfonts, args.styles, args.filter_styles)
 
-            characters = re_filter_characters(fonts[0], args.characters)
-            proof_rendering(
+            characters = re_filter_characters(dfonts[0], args.characters)
+            reports = proof_rendering(
                 styles,
                 templates,
                 args.out,
@@ -53,15 +61,15 @@ def main():
 
         elif args.command == "diff":
             fonts_before = [
-                DFont(os.path.abspath(fp), suffix="old") for fp in args.fonts_before
+                _load_font(fp, "old", fonts) for fp in args.fonts_before
             ]
             fonts_after = [
-                DFont(os.path.abspath(fp), suffix="new") for fp in args.fonts_after
+                _load_font(fp, "new", fonts) for fp in args.fonts_after
             ]
             matcher = FontMatcher(fonts_before, fonts_after)
             getattr(matcher, args.styles)(args.filter_styles)
             characters = re_filter_characters(fonts_before[0], args.characters)
-            diff_rendering(
+            reports = diff_rendering(
                 matcher,
                 templates,
                 args.out,
@@ -73,9 +81,19 @@ def main():
 
         if args.imgs:
             imgs_out = os.path.join(args.out, "imgs")
-            from diffenator2.screenshot import screenshot_dir
+            from diffenator2.screenshot import screenshot_files
+
+            # Other styles' reports in the out dir may still be being
+            # written, so only screenshot this run's reports
+            reports += screenshot_files(reports, args.out, imgs_out)
 
-            screenshot_dir(args.out, imgs_out)
+    if getattr(args, "stamp", None):
+        write_stamp(args.stamp, reports)
+
+
+def main():
+    # Maybe json load/dump is better
+    run(types.SimpleNamespace(**ast.literal_eval(sys.argv[1])))
 
 
 if __name__ == "__main__":
@@ -8,20 +8,24 @@ from diffenator2.utils import (
     string_coords_to_dict,
     re_filter_characters,
     characters_in_string,
+    write_stamp,
 )
 from diffenator2.font import DFont
 from diffenator2.matcher import FontMatcher
 import os
-from diffenator2.shape import test_words, test_fonts
+from diffenator2.shape import test_words, test_fonts, changed_characters
 from diffenator2 import jfont, THRESHOLD
+from diffenator2.layout import LayoutDiff
 from diffenator2.html import diffenator_report
+from diffenator2.cache import DiskCache, CACHE_FILE, flush_caches
+from functools import cached_property, lru_cache
 import types
 import ast
 import sys
 
 
 class DiffFonts:
-    def __init__(self, matcher, threshold=0.01, font_size=28, words=True, tables=True, debug_gifs=False):
+    def __init__(self, matcher, threshold=0.01, font_size=28, words=True, tables=True, debug_gifs=False, renderer=None, jobs=1, only_changed_words=False):
         self.old_font = matcher.old_fonts[0]
         self.new_font = matcher.new_fonts[0]
 
@@ -32,16 +36,38 @@ class DiffFonts:
         self.do_tables = tables
         self.font_size = font_size
         self.debug_gifs = debug_gifs
+        self.renderer = renderer
+        self.jobs = jobs
+        self.only_changed_words = only_changed_words
+        self.layout = None
 
     def diff_all(self):
         self.diff_tables()
         self.diff_words()
 
     def diff_tables(self):
+        # diffs are kept in the fonts' disk cache, if they have one
+        cache = self.old_font.disk_cache
+        self.tables = jfont.TableDiff(
+            self.old_font.ttFont,
+            self.new_font.ttFont,
+            tables=None if self.do_tables else [],
+            cache=cache,
+        )
         if not self.do_tables:
-            self.tables = jfont.Diff({}, {})
             return
-        self.tables = jfont.Diff(self.old_font.jFont, self.new_font.jFont)
+        # jfont doesn't serialise GSUB and GPOS, they're flattened instead
+        self.layout = LayoutDiff(self.old_font.ttFont, self.new_font.ttFont, cache=cache)
+        for tag, diff in self.layout.diff.items():
+            self.tables.add(tag, diff)
+
+    @cached_property
+    def word_characters(self):
+        """Characters a word must contain to be diffed, or None to diff
+        every word"""
+        if not self.only_changed_words:
+            return None
+        return changed_characters(self.old_font, self.new_font, self.layout)
 
     def diff_strings(self, fp):
         self.strings = test_words(
@@ -50,6 +76,9 @@ class DiffFonts:
             self.new_font,
             threshold=self.threshold,
             font_size=self.font_size,
+            renderer=self.renderer,
+            jobs=self.jobs,
+            characters=self.word_characters,
         )
 
     def diff_words(self):
@@ -60,6 +89,9 @@ class DiffFonts:
             do_words=self.do_words,
             font_size=self.font_size,
             debug_gifs=self.debug_gifs,
+            renderer=self.renderer,
+            jobs=self.jobs,
+            word_characters=self.word_characters if self.do_words else None,
         )
 
     def filter_characters(self, characters):
@@ -83,17 +115,26 @@ class DiffFonts:
         ]
 
     def to_html(self, templates, out):
-        diffenator_report(self, templates, dst=out)
+        return diffenator_report(self, templates, dst=out)
 
 
-def main():
-    # Maybe json load/dump is better
-    args = types.SimpleNamespace(**ast.literal_eval(sys.argv[1]))
-
+def run(args, fonts=None):
+    """Diff a single style. fonts is an optional dict used to reuse fonts
+    between runs which share the same pair of font files"""
     coords = string_coords_to_dict(args.coords)
 
-    old_font = DFont(os.path.abspath(args.old_font), suffix="old")
-    new_font = DFont(os.path.abspath(args.new_font), suffix="new")
+    key = (os.path.abspath(args.old_font), os.path.abspath(args.new_font))
+    if fonts is not None and key in fonts:
+        old_font, new_font = fonts[key]
+    else:
+        old_font = DFont(key[0], suffix="old")
+        new_font = DFont(key[1], suffix="new")
+        if fonts is not None:
+            fonts[key] = (old_font, new_font)
+    if getattr(args, "cache_dir", None):
+        disk_cache = _disk_cache(os.path.join(args.cache_dir, CACHE_FILE))
+        old_font.set_disk_cache(disk_cache)
+        new_font.set_disk_cache(disk_cache)
     matcher = FontMatcher([old_font], [new_font])
     matcher.diffenator(coords)
     matcher.upms()
@@ -105,6 +146,9 @@ def main():
         threshold=args.threshold,
         font_size=args.font_size,
         debug_gifs=args.debug_gifs,
+        renderer=args.renderer,
+        jobs=args.jobs,
+        only_changed_words=args.only_changed_words,
     )
     diff.diff_all()
     if args.user_wordlist:
@@ -112,7 +156,21 @@ def main():
 
     characters = re_filter_characters(new_font, args.characters)
     diff.filter_characters(characters)
-    diff.to_html(args.diffenator_template, args.out)
+    reports = diff.to_html(args.diffenator_template, args.out)
+    flush_caches()
+    if getattr(args, "stamp", None):
+        write_stamp(args.stamp, reports)
+
+
+@lru_cache(maxsize=None)
+def _disk_cache(path):
+    # one cache per file, so fonts reused between runs keep theirs
+    return DiskCache(os.path.abspath(path))
+
+
+def main():
+    # Maybe json load/dump is better
+    run(types.SimpleNamespace(**ast.literal_eval(sys.argv[1])))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+"""
+Cache rendering results on disk so they can be reused between runs.
+
+Diffing a font against many builds renders the same glyphs over and over.
+DiskCache is a size capped SQLite store, shared by every process which
+opens the same file. Entries are keyed on the sha256 of the font's data,
+so a font's entries stay valid however often its path is reused. The
+least recently used entries are evicted once the cache is over its size.
+
+Rasterized glyph tiles are stored, as are the results of diffing glyphs,
+words and tables, keyed on the inputs which decide them. Shaped words
+aren't stored, looking one up takes longer than shaping it with HarfBuzz.
+"""
+from __future__ import annotations
+from weakref import WeakSet
+import hashlib
+import pickle
+import sqlite3
+import atexit
+import time
+import zlib
+import os
+
+
+# Bump when the way cached values are made changes
+VERSION = 5
+DEFAULT_MAX_SIZE = 1 << 30  # bytes
+CACHE_FILE = "cache.sqlite"
+# Writes are batched since each commit syncs the write ahead log
+FLUSH_EVERY = 512
+# Evict down to this fraction of max_size so the next writes don't evict
+EVICT_TO = 0.9
+
+_open_caches = WeakSet()
+
+
+class DiskCache:
+    def __init__(self, path: str, max_size: int = DEFAULT_MAX_SIZE):
+        """Key value store in a SQLite file. The database is opened on first
+        use, so caches can be sent to worker processes."""
+        self.path = path
+        self.max_size = max_size
+        self._db = None
+        self._pid = None
+        self._pending = {}
+        self._used = set()
+        _open_caches.add(self)
+
+    def __reduce__(self):
+        return DiskCache, (self.path, self.max_size)
+
+    @property
+    def db(self):
+        # sqlite connections can't be shared with forked processes
+        if self._pid != os.getpid():
+            if self._pid is not None:
+                # the parent process writes its own pending entries
+                self._pending, self._used = {}, set()
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key BLOB PRIMARY KEY, value BLOB, size INTEGER, used REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    @staticmethod
+    def key(*parts) -> bytes:
+        return hashlib.blake2b(
+            repr((VERSION,) + parts).encode("utf8"), digest_size=20
+        ).digest()
+
+    def get(self, key: bytes):
+        if key in self._pending:
+            return self._pending[key]
+        row = self.db.execute(
+            "SELECT value FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._used.add(key)
+        return row[0]
+
+    def put(self, key: bytes, value: bytes):
+        self._pending[key] = value
+        if len(self._pending) >= FLUSH_EVERY:
+            self.flush()
+
+    def load(self, key: bytes):
+        """Read a value written by store, or None if it isn't cached"""
+        data = self.get(key)
+        if data is None:
+            return None
+        return _decode(data)
+
+    def store(self, key: bytes, value):
+        self.put(key, _encode(value))
+
+    def flush(self):
+        """Write pending entries, mark the entries which have been read as
+        recently used and evict old entries if the cache is too big"""
+        if not self._pending and not self._used:
+            return
+        now = time.time()
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                ((k, v, len(v), now) for k, v in self._pending.items()),
+            )
+            db.executemany(
+                "UPDATE entries SET used = ? WHERE key = ?",
+                ((now, k) for k in self._used),
+            )
+            self._evict()
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self._pending, self._used = {}, set()
+
+    def size(self) -> int:
+        """Bytes used by the database, not counting free pages"""
+        db = self.db
+        page_size = db.execute("PRAGMA page_size").fetchone()[0]
+        pages = db.execute("PRAGMA page_count").fetchone()[0]
+        free = db.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * page_size
+
+    def _evict(self):
+        size = self.size()
+        if size <= self.max_size:
+            return
+        excess = size - int(self.max_size * EVICT_TO)
+        keys = []
+        for key, size in self.db.execute(
+            "SELECT key, size FROM entries ORDER BY used"
+        ):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.db.executemany("DELETE FROM entries WHERE key = ?", keys)
+
+    def close(self):
+        self.flush()
+        if self._db is not None and self._pid == os.getpid():
+            self._db.close()
+        self._db = self._pid = None
+
+
+def _encode(value):
+    return zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 1)
+
+
+def _decode(data):
+    return pickle.loads(zlib.decompress(data))
+
+
+def flush_caches():
+    """Flush every cache this process has opened. Pool workers don't run
+    atexit handlers, so they call this when they finish a task."""
+    for cache in list(_open_caches):
+        cache.flush()
+
+
+atexit.register(flush_caches)
+
+
+class CachedDict(dict):
+    """A dict which reads and writes through to a DiskCache. Entries are
+    picklable values stored under a namespace, such as a font's hash.
+    Lookups must check `key in cache` before reading cache[key]."""
+
+    def __init__(self, disk: DiskCache, namespace: str):
+        super().__init__()
+        self.disk = disk
+        self.namespace = namespace
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        data = self.disk.get(self.disk.key(self.namespace, key))
+        if data is None:
+            return False
+        dict.__setitem__(self, key, _decode(data))
+        return True
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.disk.store(self.disk.key(self.namespace, key), value)
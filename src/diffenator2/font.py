@@ -1,17 +1,24 @@
 from __future__ import annotations
 from fontTools.ttLib import TTFont
 from fontTools.ttLib.scaleUpem import scale_upem
+from fontTools.pens.recordingPen import DecomposingRecordingPen
+import hashlib
+import struct
+import sys
+from array import array
 import os
 from diffenator2 import jfont
 import uharfbuzz as hb
 import logging
 from blackrenderer.font import BlackRendererFont
 import freetype as ft
-from functools import lru_cache
+from functools import lru_cache, cached_property
+from io import BytesIO
 from itertools import product
 from diffenator2.template_elements import CSSFontFace, CSSFontStyle
 from diffenator2.masters import find_masters
 from diffenator2.utils import dict_coords_to_string
+from diffenator2.cache import DiskCache, CachedDict
 import re
 
 logger = logging.getLogger(__name__)
@@ -55,18 +62,61 @@ class DFont:
     def __init__(self, path: str, font_size: int = 1000, suffix=""):
         self.path = path
         self.suffix = suffix
-        self.ttFont: TTFont = TTFont(self.path, recalcTimestamp=False)
-        self.family_name = self.ttFont["name"].getBestFamilyName()
-        self.blackFont: BlackRendererFont = BlackRendererFont(path)
-        self.ftFont: ft.Face = ft.Face(self.path)
+        # The font file is read once and the same bytes are shared by every
+        # font engine. blackFont and ftFont are only created if a renderer
+        # needs them.
         with open(path, "rb") as fontfile:
-            fontdata = fontfile.read()
-        self.hbFont: hb.Font = hb.Font(hb.Face(fontdata))
+            self.data: bytes = fontfile.read()
+        self.ttFont: TTFont = TTFont(self._stream(), recalcTimestamp=False)
+        self.family_name = self.ttFont["name"].getBestFamilyName()
+        self.hbFont: hb.Font = hb.Font(hb.Face(self.data))
+        hb.ot_font_set_funcs(self.hbFont)
 
         self.css_font_face = CSSFontFace(self.ttFont, self.suffix)
 
         self.font_size: int = font_size
         self.set_font_size(self.font_size)
+        # rasterized glyph tiles, see Renderer.glyph_tile
+        self.glyph_cache: dict[tuple, any] = {}
+        self.disk_cache: DiskCache = None
+        self.glyph_hashes: dict[tuple, str] = {}
+        self._location = None
+
+    def _stream(self):
+        # BytesIO doesn't copy the bytes unless it's written to
+        stream = BytesIO(self.data)
+        stream.name = self.path
+        return stream
+
+    @cached_property
+    def sha256(self) -> str:
+        return hashlib.sha256(self.data).hexdigest()
+
+    def set_disk_cache(self, disk_cache: DiskCache):
+        """Keep rasterized glyph tiles in a cache on disk as well as in
+        memory. Must be set before any renderers are made for the font."""
+        if disk_cache is self.disk_cache:
+            return
+        self.disk_cache = disk_cache
+        self.glyph_cache = CachedDict(disk_cache, self.sha256)
+
+    @cached_property
+    def blackFont(self) -> BlackRendererFont:
+        # Use a separate TTFont since self.ttFont may be rescaled by the
+        # matcher. The hb font is shared so it has the same variations.
+        font = BlackRendererFont(
+            ttFont=TTFont(self._stream(), lazy=True), hbFont=self.hbFont
+        )
+        if getattr(self, "variations", None):
+            font.setLocation(self.variations)
+        return font
+
+    @cached_property
+    def ftFont(self) -> ft.Face:
+        face = ft.Face(self._stream())
+        if getattr(self, "variations", None):
+            face.set_var_design_coords(self._ft_coords(self.variations))
+        return face
 
     @property
     @lru_cache()
@@ -80,20 +130,107 @@ class DFont:
     def is_variable(self):
         return "fvar" in self.ttFont
 
+    def glyph_hash(self, glyph_name: str) -> str:
+        """Hash a glyph's outline and advance at the current variations.
+
+        Components are resolved, so two glyphs which have the same hash will
+        draw the same outline. Glyphs with a different hash may still look
+        identical."""
+        location = self._normalized_location()
+        key = (location, glyph_name)
+        if key not in self.glyph_hashes:
+            if "glyf" in self.ttFont:
+                data = self._glyf_glyph_data(glyph_name, location)
+            else:
+                data = self._drawn_glyph_data(glyph_name, location)
+            self.glyph_hashes[key] = hashlib.sha1(data).hexdigest()
+        return self.glyph_hashes[key]
+
+    def _normalized_location(self):
+        # Fonts may have different axis orders, ranges or avar mappings so
+        # compare the normalized coordinates HarfBuzz uses, not user coords.
+        # It's computed for every glyph hash, so it's kept until the
+        # variations change.
+        if self._location is None:
+            if not self.is_variable():
+                self._location = ()
+            else:
+                tags = [a.axisTag for a in self.ttFont["fvar"].axes]
+                coords = self.hbFont.get_var_coords_normalized()
+                self._location = tuple(
+                    sorted((t, c) for t, c in zip(tags, coords) if c != 0)
+                )
+        return self._location
+
+    def _glyf_glyph_data(self, glyph_name, location):
+        # Hashing the compiled glyph and its gvar deltas is much cheaper
+        # than instancing the outline. Component glyph ids are only
+        # meaningful within a font so hash the components themselves too.
+        glyf = self.ttFont["glyf"]
+        glyph = glyf.glyphs[glyph_name]
+        data = [
+            glyph.compile(glyf, recalcBBoxes=False),
+            repr(self.ttFont["hmtx"][glyph_name]).encode("utf8"),
+        ]
+        for component in glyph.getComponentNames(glyf):
+            data.append(self.glyph_hash(component).encode("utf8"))
+        if location and "gvar" in self.ttFont:
+            data.append(repr(location).encode("utf8"))
+            data.append(self._gvar_glyph_data(self.ttFont.getGlyphID(glyph_name)))
+        return b"".join(data)
+
+    @lru_cache()
+    def _gvar_offsets(self):
+        data = self.ttFont.getTableData("gvar")
+        _, axis_count, tuple_count, tuples_offset, glyph_count, flags, data_offset = \
+            struct.unpack(">LHHLHHL", data[:20])
+        offsets = array("I" if flags & 1 else "H")
+        offsets.frombytes(data[20 : 20 + offsets.itemsize * (glyph_count + 1)])
+        if sys.byteorder == "little":
+            offsets.byteswap()
+        if not flags & 1:
+            offsets = [o * 2 for o in offsets]
+        shared_tuples = data[tuples_offset : tuples_offset + tuple_count * axis_count * 2]
+        return data, offsets, data_offset, shared_tuples
+
+    def _gvar_glyph_data(self, gid):
+        data, offsets, data_offset, shared_tuples = self._gvar_offsets()
+        start, end = data_offset + offsets[gid], data_offset + offsets[gid + 1]
+        return shared_tuples + data[start:end]
+
+    @lru_cache()
+    def _glyph_set(self, location):
+        return self.ttFont.getGlyphSet(location=getattr(self, "variations", None))
+
+    def _drawn_glyph_data(self, glyph_name, location):
+        glyph_set = self._glyph_set(location)
+        glyph = glyph_set[glyph_name]
+        pen = DecomposingRecordingPen(glyph_set)
+        glyph.draw(pen)
+        return repr((pen.value, glyph.width)).encode("utf8")
+
     def set_font_size(self, size: int):
         self.font_size = size
 
     def set_variations(self, coords: dict[str, float]):
-        if coords == {}:
+        # Moving the engines to a location invalidates their caches, so
+        # only do it when the location changes
+        if coords == {} or coords == getattr(self, "variations", None):
             return
+        if "ftFont" in self.__dict__:
+            self.ftFont.set_var_design_coords(self._ft_coords(coords))
+        self.variations = dict(coords)
+        self.hbFont.set_variations(coords)
+        self._location = None
+        if "blackFont" in self.__dict__:
+            self.blackFont.setLocation(coords)
+
+    def _ft_coords(self, coords):
         # freetype-py's api uses a tuple/list
-        ft_coords = [
+        return [
             a.defaultValue if a.axisTag not in coords else coords[a.axisTag]
             for a in self.ttFont["fvar"].axes
         ]
-        self.ftFont.set_var_design_coords(ft_coords)
-        self.variations = coords
-        self.hbFont.set_variations(coords)
     
     def closest_style(self, coords):
         fvar_axes = {a.axisTag: (a.minValue, a.maxValue) for a in self.ttFont["fvar"].axes}
@@ -167,5 +304,31 @@ class DFont:
             results.append(Style(self, coords))
         return results
 
+    def __reduce__(self):
+        # Fonts are sent to worker processes by path, along with any state
+        # which has been applied to them since they were loaded.
+        return (
+            _load_font,
+            (
+                self.path,
+                self.font_size,
+                self.suffix,
+                getattr(self, "variations", None),
+                self.ttFont["head"].unitsPerEm,
+                self.disk_cache,
+            ),
+        )
+
     def __repr__(self):
         return f"<DFont: {self.path}>"
+
+
+def _load_font(path, font_size, suffix, variations, upm, disk_cache=None):
+    font = DFont(path, font_size, suffix)
+    if disk_cache is not None:
+        font.set_disk_cache(disk_cache)
+    if font.ttFont["head"].unitsPerEm != upm:
+        scale_upem(font.ttFont, upm)
+    if variations:
+        font.set_variations(variations)
+    return font
@@ -9,7 +9,7 @@ from diffenator2.template_elements import CSSFontStyle, CSSFontFace
 from diffenator2.utils import font_sample_text, characters_in_string, GFTestData
 import re
 from pathlib import Path
-from diffenator2.shape import parse_wordlist
+from diffenator2.wordlist import parse_wordlist
 from urllib.parse import quote
 
 
@@ -99,7 +99,7 @@ def proof_rendering(styles, templates, dst="out", filter_styles=None, characters
     characters = characters or [chr(c) for c in ttFont.getBestCmap()]
     characters = list(sorted(characters))
     user_words = None if not user_wordlist else parse_wordlist(user_wordlist)
-    _package(
+    return _package(
         templates,
         dst,
         font_faces=font_faces,
@@ -128,7 +128,7 @@ def diff_rendering(matcher, templates, dst="out", filter_styles=None, characters
     characters = characters or [chr(c) for c in ttFont.getBestCmap()]
     characters = list(sorted(characters))
     user_words = None if not user_wordlist else parse_wordlist(user_wordlist)
-    _package(
+    return _package(
         templates,
         dst,
         font_faces_old=font_faces_old,
@@ -155,7 +155,11 @@ def diffenator_report(diff, template, dst="out"):
     font_styles_old[0].cssfamilyname = "old font"
     font_styles_new = [diff.new_style.css_font_style]
     font_styles_new[0].cssfamilyname = "new font"
-    _package(
+    # table diffs are loaded by the report from a sidecar dir
+    prefix = _diff_prefix(font_faces_new[0], font_styles_new[0])
+    tables_dir = os.path.join(dst, f"{prefix}-tables")
+    diff.tables.save(tables_dir)
+    return [tables_dir] + _package(
         [template],
         dst,
         diff=diff,
@@ -185,9 +189,17 @@ def build_index_page(fp):
         doc.write("\n".join(a_hrefs))
 
 
+def _diff_prefix(font_face, font_style):
+    filename = font_face.filename.replace("new-", "").strip().replace(" ", "_")[:-4]
+    return f"{filename}-{font_style.stylename}"
+
+
 def _package(templates, dst, **kwargs):
+    """Write the templates' docs and copy their fonts to dst. Returns the
+    paths of the files written."""
     if not os.path.exists(dst):
         os.makedirs(dst)
+    written = []
 
     # write docs
     for template_fp in templates:
@@ -205,12 +217,13 @@ def _package(templates, dst, **kwargs):
         if "filter_styles" in kwargs:
             fp_prefix = kwargs.get("filter_styles")
         elif "diff" in kwargs:
-            filename = kwargs.get("font_faces_new")[0].filename.replace("new-", "").strip().replace(" ", "_")[:-4]
-            style = kwargs.get("font_styles_new")[0].stylename
-            fp_prefix = f"{filename}-{style}"
+            fp_prefix = _diff_prefix(
+                kwargs.get("font_faces_new")[0], kwargs.get("font_styles_new")[0]
+            )
         dst_doc = os.path.join(dst, f'{fp_prefix}-{os.path.basename(template_fp)}')
         with open(dst_doc, "w", encoding="utf8") as out_file:
             out_file.write(doc)
+        written.append(dst_doc)
 
     # copy fonts
     # make this more general purpose for ttfont objects
@@ -218,4 +231,6 @@ def _package(templates, dst, **kwargs):
         if k in kwargs:
             for font in kwargs[k]:
                 out_fp = os.path.join(dst, font.filename)
-                shutil.copy(font.ttfont.reader.file.name, out_fp)
\ No newline at end of file
+                shutil.copy(font.ttfont.reader.file.name, out_fp)
+                written.append(out_fp)
+    return written
\ No newline at end of file
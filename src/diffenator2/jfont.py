@@ -1,7 +1,12 @@
 from __future__ import annotations
 
 import json
-from copy import deepcopy as copy
+import hashlib
+import os
+import shutil
+import tempfile
+from urllib.parse import quote
+from functools import lru_cache
 
 from fontTools.ttLib import TTFont
 from fontTools.ttLib.tables._c_m_a_p import table__c_m_a_p
@@ -192,11 +197,82 @@ def serialise_glyph(obj, root):
         return contours
 
 
-def TTJ(ttFont):
+SKIP_TABLES = ["GlyphOrder", "loca", "GPOS", "GSUB", "GVAR"]
+# Tables whose serialisation includes data from other tables
+TABLE_DEPENDENCIES = {
+    "fvar": ["name"],
+    "STAT": ["name"],
+}
+# Tables which are decompiled using data from other tables
+DECOMPILE_DEPENDENCIES = {
+    "glyf": ["loca"],
+    "gvar": ["fvar", "glyf", "loca"],
+    "cvar": ["cvt ", "fvar"],
+    "avar": ["fvar"],
+    "hmtx": ["hhea"],
+    "vmtx": ["vhea"],
+}
+
+
+def table_dependencies(tag):
+    """The tables a table is serialised with, and those it's decompiled with
+    including the tables they're decompiled with"""
+    deps = list(TABLE_DEPENDENCIES.get(tag, []))
+    todo = [tag]
+    while todo:
+        for dep in DECOMPILE_DEPENDENCIES.get(todo.pop(), []):
+            if dep != tag and dep not in deps:
+                deps.append(dep)
+                todo.append(dep)
+    return deps
+
+
+def table_key(ttFont, tag):
+    """Hash of a table and everything else which decides how it's
+    serialised. Tables with the same key serialise the same."""
+    h = hashlib.sha256("\n".join(ttFont.getGlyphOrder()).encode("utf8"))
+    if "head" in ttFont:
+        head = ttFont["head"]
+        h.update(repr((head.unitsPerEm, head.indexToLocFormat)).encode("utf8"))
+    for t in [tag] + table_dependencies(tag):
+        h.update(t.encode("utf8"))
+        if t in ttFont:
+            h.update(hashlib.sha256(ttFont.getTableData(t)).digest())
+    return h.hexdigest()
+
+
+def changed_tables(ttFont_a, ttFont_b):
+    """Tags of the tables which may serialise differently in each font.
+
+    Tables are keyed by glyph name once serialised, so tables with the same
+    compiled bytes only serialise the same if the glyph orders match too.
+    A table is also diffed if a table it's serialised or decompiled with
+    has changed, e.g glyf when only loca has changed."""
+    tags = (set(ttFont_a.keys()) | set(ttFont_b.keys())) - set(SKIP_TABLES)
+    if ttFont_a.getGlyphOrder() != ttFont_b.getGlyphOrder():
+        return sorted(tags)
+
+    @lru_cache(maxsize=None)
+    def same(tag):
+        if tag not in ttFont_a or tag not in ttFont_b:
+            return False
+        return ttFont_a.getTableData(tag) == ttFont_b.getTableData(tag)
+
+    return sorted(
+        tag
+        for tag in tags
+        if not (same(tag) and all(same(t) for t in table_dependencies(tag)))
+    )
+
+
+def TTJ(ttFont, tables=None):
+    """Serialise a TTFont. If tables is given, only serialise those tables"""
+    if tables is None:
+        tables = [k for k in ttFont.keys() if k not in SKIP_TABLES]
     # we must compile the glyph in order to access coordinates etc
-    ttFont["glyf"].compile(ttFont)
-    root = ttFont
-    return _TTJ(ttFont, root)
+    if "glyf" in tables and "glyf" in ttFont:
+        ttFont["glyf"].compile(ttFont)
+    return {k: _TTJ(ttFont[k], ttFont) for k in tables if k in ttFont}
 
 
 def _TTJ(obj, root=None, depth=1):
@@ -225,11 +301,7 @@ def _TTJ(obj, root=None, depth=1):
     elif isinstance(obj, TTFont):
         if depth > 1:
             return None
-        return {
-            k: _TTJ(obj[k], root)
-            for k in obj.keys()
-            if k not in ["loca", "GPOS", "GSUB", "GVAR"]
-        }
+        return TTJ(obj)
     elif isinstance(obj, dict):
         return {k: _TTJ(v, root) for k, v in obj.items()}
     elif isinstance(obj, (list, tuple, set)):
@@ -239,75 +311,107 @@ def _TTJ(obj, root=None, depth=1):
     return obj
 
 
+SCALARS = (int, float, str)
+# Dicts with at least this many changes are replaced with an error message
+MAX_CHANGES = 200
+
+
+def _same(obj1, obj2):
+    # Quickly skip identical subtrees. Anything which can't be compared
+    # this way is walked instead.
+    try:
+        return bool(obj1 == obj2)
+    except (TypeError, ValueError, RecursionError):
+        return False
+
+
+def _children(obj1, obj2):
+    """Pairs of sub objects to diff. A dict or list is diffed against each
+    item of the other object if that isn't a dict or list"""
+    res = []
+    dict1, dict2 = isinstance(obj1, dict), isinstance(obj2, dict)
+    if dict1 and dict2:
+        res += [(k, obj1.get(k), obj2.get(k)) for k in obj1]
+        res += [(k, None, obj2[k]) for k in obj2 if k not in obj1]
+    elif dict1:
+        res += [(k, v, obj2) for k, v in obj1.items()]
+    elif dict2:
+        res += [(k, obj1, v) for k, v in obj2.items()]
+    list1, list2 = isinstance(obj1, list), isinstance(obj2, list)
+    if list1 and list2:
+        for i in range(max(len(obj1), len(obj2))):
+            res.append(
+                (
+                    i,
+                    obj1[i] if i < len(obj1) else None,
+                    obj2[i] if i < len(obj2) else None,
+                )
+            )
+    elif list1:
+        res += [(i, v, obj2) for i, v in enumerate(obj1)]
+    elif list2:
+        res += [(i, obj1, v) for i, v in enumerate(obj2)]
+    if dict1 and list2 or list1 and dict2:
+        # an index may also be a key, the last pair wins
+        res = list({k: (k, a, b) for k, a, b in res}.values())
+    return res
+
+
+def _leaf(obj1, obj2):
+    """[obj1, obj2] if they're different values, False if they're the same
+    value and None if they need to be diffed item by item"""
+    if obj1 is None and obj2 is None:
+        return False
+    scalar1, scalar2 = isinstance(obj1, SCALARS), isinstance(obj2, SCALARS)
+    if scalar1 and scalar2:
+        return False if obj1 == obj2 else [obj1, obj2]
+    if scalar1 and obj2 is None or obj1 is None and scalar2:
+        return [obj1, obj2]
+    return None
+
+
 class Diff:
     def __init__(self, obj_a, obj_b):
-        """A basic general purposes dict differ. Should not be tied to fonts!"""
+        """A basic general purposes dict differ. Should not be tied to fonts!
+
+        Unchanged values are left out. Changed values are [a, b] lists
+        and dicts with too many changes are replaced by an error."""
         self.obj_a = obj_a
         self.obj_b = obj_b
-        self.diff = self.clean(self._diff(self.obj_a, self.obj_b))
-
-    def _diff(self, obj1, obj2, path=[]):
-        """Diff to json objects. Output as html"""
-        if obj1 is None and obj2 is None:
-            return False
-        elif isinstance(obj1, (int, float, str)) and isinstance(
-            obj2, (int, float, str)
-        ):
-            if obj1 == obj2:
-                return False
-            return obj1, obj2
-        elif isinstance(obj1, (int, float, str)) and obj2 is None:
-            return obj1, obj2
-        elif obj1 is None and isinstance(obj2, (int, float, str)):
-            return obj1, obj2
-
-        res = {}
-        if isinstance(obj1, dict) and isinstance(obj2, dict):
-            for k in set(obj1.keys()) | set(obj2.keys()):
-                if k in obj1 and k in obj2:
-                    res[k] = self._diff(obj1[k], obj2[k], path + [k])
-                elif k in obj1 and k not in obj2:
-                    res[k] = self._diff(obj1[k], None, path + [k])
-                else:
-                    res[k] = self._diff(None, obj2[k], path + [k])
-        elif isinstance(obj1, dict) and not isinstance(obj2, dict):
-            for k in obj1:
-                res[k] = self._diff(obj1[k], obj2, path=path + [k])
-        elif not isinstance(obj1, dict) and isinstance(obj2, dict):
-            for k in obj2:
-                res[k] = self._diff(obj1, obj2[k], path + [k])
-        if isinstance(obj1, list) and isinstance(obj2, list):
-            for i in range(max(len(obj1), len(obj2))):
-                if i < len(obj1) and i < len(obj2):
-                    res[i] = self._diff(obj1[i], obj2[i], path + [i])
-                elif i < len(obj1) and i >= len(obj2):
-                    res[i] = self._diff(obj1[i], None, path + [i])
-                else:
-                    res[i] = self._diff(None, obj2[i], path + [i])
-        elif isinstance(obj1, list) and not isinstance(obj2, list):
-            for i in range(len(obj1)):
-                res[i] = self._diff(obj1[i], obj2, path + [i])
-        elif not isinstance(obj1, list) and isinstance(obj2, list):
-            for i in range(len(obj2)):
-                res[i] = self._diff(obj1, obj2[i], path + [i])
-        return res
-
-    def clean(self, obj):
-        """Remove any paths which are False or contain too many changes"""
-        if obj is None:
-            return None
-        if isinstance(obj, tuple):
-            return list(obj)
-        if obj == False:
-            return False
-        res = copy(obj)
-        for k, v in obj.items():
-            res[k] = self.clean(v)
-            if res[k] == False or not res[k]:
-                res.pop(k)
-        if len(res) >= 200:
-            return {"error": (f"There are {len(res)} changes, check manually!", "")}
-        return res
+        self.diff = self._diff(self.obj_a, self.obj_b)
+
+    def _diff(self, obj1, obj2):
+        leaf = _leaf(obj1, obj2)
+        if leaf is not None:
+            return leaf
+        root = {}
+        # Walk both objects with an explicit stack so deep trees don't hit
+        # the recursion limit. Only changed values are ever stored. A
+        # container is entered, its children are diffed into a new dict,
+        # then it's exited and the dict is added to its parent if it
+        # has changes.
+        stack = [(False, root, None, obj1, obj2)]
+        while stack:
+            exiting, parent, key, obj1, obj2 = stack.pop()
+            if exiting:
+                res = obj1
+                if len(res) >= MAX_CHANGES:
+                    parent[key] = {
+                        "error": (f"There are {len(res)} changes, check manually!", "")
+                    }
+                elif res:
+                    parent[key] = res
+                continue
+            res = {}
+            stack.append((True, parent, key, res, None))
+            for k, a, b in _children(obj1, obj2):
+                leaf = _leaf(a, b)
+                if leaf is None:
+                    if not _same(a, b):
+                        stack.append((False, res, k, a, b))
+                elif leaf:
+                    res[k] = leaf
+        return root.get(None, {})
 
     def render(self):
         return f"<script>var fontdiff = {json.dumps(self.diff)};</script>"
@@ -316,6 +420,63 @@ class Diff:
         raise NotImplementedError()
 
 
+class TableDiff:
+    def __init__(self, ttFont_a, ttFont_b, tables=None, cache=None):
+        """Diff two fonts one table at a time. Each table's diff is written
+        to its own script as soon as it's computed so only a single table
+        is held in memory. Reports load a table's script when its node is
+        opened.
+
+        tables: tags of the tables to diff. Defaults to the changed tables.
+        cache: optional diffenator2.cache.DiskCache. Table diffs are kept
+        in it and reused while both tables are unchanged."""
+        if tables is None:
+            tables = changed_tables(ttFont_a, ttFont_b)
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = self._tmp.name
+        self.files = {}
+        for tag in tables:
+            key = cached = None
+            if cache is not None:
+                key = cache.key(
+                    "table diff", tag, table_key(ttFont_a, tag), table_key(ttFont_b, tag)
+                )
+                cached = cache.load(key)
+            if cached is None:
+                # tables without changes are cached as (None,)
+                cached = (Diff(TTJ(ttFont_a, [tag]), TTJ(ttFont_b, [tag])).diff.get(tag),)
+                if cache is not None:
+                    cache.store(key, cached)
+            self.add(tag, cached[0])
+
+    def add(self, tag, diff):
+        """Write a table's diff"""
+        if not diff:
+            return
+        filename = f"{len(self.files)}.js"
+        with open(os.path.join(self.path, filename), "w", encoding="utf8") as doc:
+            # scripts rather than json so reports work from file:// urls
+            doc.write(f"fontdiffLoaded({json.dumps(tag)}, ")
+            json.dump(diff, doc)
+            doc.write(");\n")
+        self.files[tag] = filename
+
+    def save(self, dst):
+        """Copy the table scripts to dst. The report must be in dst's parent"""
+        if os.path.exists(dst):
+            shutil.rmtree(dst)
+        shutil.copytree(self.path, dst)
+        self.path = dst
+
+    def render(self):
+        src = quote(os.path.basename(self.path))
+        files = {tag: f"{src}/{f}" for tag, f in self.files.items()}
+        return (
+            f"<script>var fontdiff = {json.dumps(dict.fromkeys(self.files))};\n"
+            f"var fontdiffFiles = {json.dumps(files)};</script>"
+        )
+
+
 # class TTJDiff(Diff):
 #     def summary(self):
 #         doc = []
@@ -0,0 +1,564 @@
+"""
+Flatten GSUB and GPOS into records so they can be diffed.
+
+Each lookup is flattened once into a dict of records. A record's key is a
+tuple of the record kind plus the glyphs, glyph classes (tuples of glyph
+names) or component indexes it applies to. Its value is what the font
+does with them, e.g the kerning value or the substituted glyphs. Keys of
+lookups with flags end with a LookupFlag, since the flags decide which
+glyphs the records match. Records are grouped by (script, language,
+feature) and diffed with set operations.
+
+Kerning is usually most of a font's GPOS so pair adjustment lookups are
+read straight from the table's bytes when the table hasn't been modified.
+"""
+from __future__ import annotations
+from fontTools.ttLib import TTFont
+from diffenator2.jfont import MAX_CHANGES, _TTJ, table_key
+import numpy as np
+import hashlib
+import struct
+
+
+# Extension lookups wrap another lookup type
+EXTENSION_TYPES = {"GSUB": 7, "GPOS": 9}
+VALUE_FIELDS = (
+    "XPlacement",
+    "YPlacement",
+    "XAdvance",
+    "YAdvance",
+    "XPlaDevice",
+    "YPlaDevice",
+    "XAdvDevice",
+    "YAdvDevice",
+)
+LOOKUP_FLAGS = (
+    (0x1, "RightToLeft"),
+    (0x2, "IgnoreBaseGlyphs"),
+    (0x4, "IgnoreLigatures"),
+    (0x8, "IgnoreMarks"),
+)
+
+
+class LookupFlag(str):
+    """A lookup's flags and mark filtering set, the last item of the keys of
+    its records"""
+
+
+class Stacked(tuple):
+    """Values of a record which several of a feature's lookups have, in the
+    order the lookups are applied"""
+
+
+def _lookup_flag(flag, mark_filtering_set=None):
+    names = [name for bit, name in LOOKUP_FLAGS if flag & bit]
+    if flag & 0x10:
+        names.append(f"MarkFilteringSet={mark_filtering_set}")
+    if flag >> 8:
+        names.append(f"MarkAttachmentType={flag >> 8}")
+    return LookupFlag(",".join(names)) if names else None
+
+
+def _with_flag(records, flag):
+    if flag is None:
+        return records
+    return {key + (flag,): value for key, value in records.items()}
+
+
+def _values(vals):
+    vals = [(k, v) for k, v in vals if v and not k.endswith("Device")]
+    if not vals:
+        return "0"
+    if len(vals) == 1 and vals[0][0] == "XAdvance":
+        return str(vals[0][1])
+    return " ".join(f"{k}={v}" for k, v in vals)
+
+
+def _value_record(vr):
+    if vr is None:
+        return "0"
+    return _values(vars(vr).items())
+
+
+def _anchor(anchor):
+    if anchor is None:
+        return None
+    return f"{anchor.XCoordinate},{anchor.YCoordinate}"
+
+
+def _classes(classified, glyphs=None):
+    """Map class numbers to tuples of glyph names. Glyphs which aren't in
+    the class def are in class 0"""
+    res = {}
+    for glyph, cls in classified.items():
+        res.setdefault(cls, []).append(glyph)
+    if glyphs is not None:
+        res[0] = [g for g in glyphs if g not in classified]
+    return {cls: tuple(sorted(g)) for cls, g in res.items()}
+
+
+def _mark_classes(mark_array, coverage):
+    res = {}
+    for glyph, record in zip(coverage.glyphs, mark_array.MarkRecord):
+        res.setdefault(record.Class, []).append(glyph)
+    return {cls: tuple(sorted(g)) for cls, g in res.items()}
+
+
+def _marks(records, mark_array, coverage):
+    classes = _mark_classes(mark_array, coverage)
+    for glyph, record in zip(coverage.glyphs, mark_array.MarkRecord):
+        records.setdefault(
+            ("mark", glyph, classes[record.Class]), _anchor(record.MarkAnchor)
+        )
+    return classes
+
+
+def _opaque(records, lookup_type, subtable):
+    # Contextual lookups are too varied to flatten. Record what they apply
+    # to and a digest of the rest so changes are still found.
+    coverage = getattr(subtable, "Coverage", None)
+    if coverage is None and hasattr(subtable, "InputCoverage"):
+        coverage = subtable.InputCoverage[0]
+    # format 3 context subtables have a coverage for each input glyph
+    if isinstance(coverage, list):
+        coverage = coverage[0] if coverage else None
+    glyphs = tuple(sorted(coverage.glyphs)) if coverage else ()
+    subtable.ensureDecompiled(recurse=True)
+    digest = hashlib.sha1(repr(_TTJ(subtable)).encode("utf8")).hexdigest()[:12]
+    records.setdefault(("context", lookup_type, glyphs), digest)
+
+
+def _gsub_records(records, lookup_type, st, glyph_order):
+    if lookup_type == 1:
+        for glyph, sub in st.mapping.items():
+            records.setdefault(("single", glyph), (sub,))
+    elif lookup_type == 2:
+        for glyph, sub in st.mapping.items():
+            records.setdefault(("multiple", glyph), tuple(sub))
+    elif lookup_type == 3:
+        for glyph, alts in st.alternates.items():
+            records.setdefault(("alternate", glyph), tuple(alts))
+    elif lookup_type == 4:
+        for first, ligatures in st.ligatures.items():
+            for lig in ligatures:
+                records.setdefault(
+                    ("ligature", first, *lig.Component), (lig.LigGlyph,)
+                )
+    else:
+        _opaque(records, lookup_type, st)
+
+
+def _gpos_records(records, lookup_type, st, glyph_order):
+    if lookup_type == 1:
+        if st.Format == 1:
+            values = [st.Value] * len(st.Coverage.glyphs)
+        else:
+            values = st.Value
+        for glyph, value in zip(st.Coverage.glyphs, values):
+            records.setdefault(("single", glyph), _value_record(value))
+    elif lookup_type == 2 and st.Format == 1:
+        for first, pair_set in zip(st.Coverage.glyphs, st.PairSet):
+            for pair in pair_set.PairValueRecord:
+                records.setdefault(
+                    ("pair", first, pair.SecondGlyph),
+                    (_value_record(pair.Value1), _value_record(pair.Value2)),
+                )
+    elif lookup_type == 2 and st.Format == 2:
+        classes1 = _classes(
+            st.ClassDef1.classDefs if st.ClassDef1 else {}, st.Coverage.glyphs
+        )
+        classes2 = _classes(
+            st.ClassDef2.classDefs if st.ClassDef2 else {}, glyph_order
+        )
+        for i, class1 in enumerate(st.Class1Record):
+            if not classes1.get(i):
+                continue
+            for j, class2 in enumerate(class1.Class2Record):
+                if not classes2.get(j):
+                    continue
+                value = (
+                    _value_record(getattr(class2, "Value1", None)),
+                    _value_record(getattr(class2, "Value2", None)),
+                )
+                # Zeros fill the unused parts of the class matrix
+                if value == ("0", "0"):
+                    continue
+                records.setdefault(("class pair", classes1[i], classes2[j]), value)
+    elif lookup_type == 3:
+        for glyph, rec in zip(st.Coverage.glyphs, st.EntryExitRecord):
+            records.setdefault(
+                ("cursive", glyph), (_anchor(rec.EntryAnchor), _anchor(rec.ExitAnchor))
+            )
+    elif lookup_type == 4:
+        classes = _marks(records, st.MarkArray, st.MarkCoverage)
+        for glyph, rec in zip(st.BaseCoverage.glyphs, st.BaseArray.BaseRecord):
+            for cls, anchor in enumerate(rec.BaseAnchor):
+                if anchor is not None and cls in classes:
+                    records.setdefault(("base", glyph, classes[cls]), _anchor(anchor))
+    elif lookup_type == 5:
+        classes = _marks(records, st.MarkArray, st.MarkCoverage)
+        for glyph, attach in zip(
+            st.LigatureCoverage.glyphs, st.LigatureArray.LigatureAttach
+        ):
+            for idx, component in enumerate(attach.ComponentRecord):
+                for cls, anchor in enumerate(component.LigatureAnchor):
+                    if anchor is not None and cls in classes:
+                        records.setdefault(
+                            ("ligature", glyph, idx, classes[cls]), _anchor(anchor)
+                        )
+    elif lookup_type == 6:
+        classes = _marks(records, st.Mark1Array, st.Mark1Coverage)
+        for glyph, rec in zip(st.Mark2Coverage.glyphs, st.Mark2Array.Mark2Record):
+            for cls, anchor in enumerate(rec.Mark2Anchor):
+                if anchor is not None and cls in classes:
+                    records.setdefault(("mark2", glyph, classes[cls]), _anchor(anchor))
+    else:
+        _opaque(records, lookup_type, st)
+
+
+def _value_fields(value_format):
+    return [f for i, f in enumerate(VALUE_FIELDS) if value_format & (1 << i)]
+
+
+def _raw_coverage(data, offset):
+    fmt, count = struct.unpack_from(">HH", data, offset)
+    if fmt == 1:
+        return np.frombuffer(data, ">u2", count, offset + 4)
+    ranges = np.frombuffer(data, ">u2", count * 3, offset + 4).reshape(-1, 3)
+    return np.concatenate(
+        [np.arange(start, end + 1) for start, end, _ in ranges] or [[]]
+    ).astype(int)
+
+
+def _raw_class_def(data, offset, glyph_order):
+    fmt = struct.unpack_from(">H", data, offset)[0]
+    if fmt == 1:
+        start, count = struct.unpack_from(">HH", data, offset + 2)
+        classes = np.frombuffer(data, ">u2", count, offset + 6)
+        gids = range(start, start + count)
+    else:
+        count = struct.unpack_from(">H", data, offset + 2)[0]
+        ranges = np.frombuffer(data, ">u2", count * 3, offset + 4).reshape(-1, 3)
+        gids = [g for start, end, _ in ranges for g in range(start, end + 1)]
+        classes = [c for start, end, c in ranges for _ in range(start, end + 1)]
+    return {glyph_order[g]: int(c) for g, c in zip(gids, classes) if c}
+
+
+def _raw_pair_pos(records, data, offset, glyph_order):
+    fmt, cov, vf1, vf2 = struct.unpack_from(">HHHH", data, offset)
+    fields1, fields2 = _value_fields(vf1), _value_fields(vf2)
+    size1, size2 = len(fields1), len(fields2)
+    coverage = [glyph_order[g] for g in _raw_coverage(data, offset + cov)]
+    if fmt == 1:
+        count = struct.unpack_from(">H", data, offset + 8)[0]
+        pair_sets = struct.unpack_from(f">{count}H", data, offset + 10)
+        width = 1 + size1 + size2
+        # fonts only use a few distinct kerning values
+        values = {}
+        for first, pair_set in zip(coverage, pair_sets):
+            start = offset + pair_set
+            n = struct.unpack_from(">H", data, start)[0]
+            rows = np.frombuffer(data, ">i2", n * width, start + 2).reshape(n, width)
+            seconds = rows[:, 0].view(">u2").tolist()
+            for second, row in zip(seconds, map(tuple, rows[:, 1:].tolist())):
+                value = values.get(row)
+                if value is None:
+                    value = values[row] = (
+                        _values(zip(fields1, row[:size1])),
+                        _values(zip(fields2, row[size1:])),
+                    )
+                records.setdefault(("pair", first, glyph_order[second]), value)
+    elif fmt == 2:
+        cd1, cd2, count1, count2 = struct.unpack_from(">HHHH", data, offset + 8)
+        classes1 = _classes(_raw_class_def(data, offset + cd1, glyph_order), coverage)
+        classes2 = _classes(_raw_class_def(data, offset + cd2, glyph_order), glyph_order)
+        width = size1 + size2
+        matrix = np.frombuffer(
+            data, ">i2", count1 * count2 * width, offset + 16
+        ).reshape(count1, count2, width)
+        for i, j in zip(*np.nonzero(matrix.any(axis=2))):
+            if not classes1.get(i) or not classes2.get(j):
+                continue
+            row = matrix[i, j].tolist()
+            value = (_values(zip(fields1, row[:size1])), _values(zip(fields2, row[size1:])))
+            # Zeros fill the unused parts of the class matrix
+            if value == ("0", "0"):
+                continue
+            records.setdefault(("class pair", classes1[i], classes2[j]), value)
+
+
+def _raw_lookup_subtables(data, tag, idx):
+    """The type, LookupFlag and offsets of a lookup's subtables in a GSUB or
+    GPOS table's bytes. Extension subtables are resolved."""
+    lookup_list = struct.unpack_from(">H", data, 8)[0]
+    lookup = lookup_list + struct.unpack_from(">H", data, lookup_list + 2 + idx * 2)[0]
+    lookup_type, flag, count = struct.unpack_from(">HHH", data, lookup)
+    offsets = [lookup + o for o in struct.unpack_from(f">{count}H", data, lookup + 6)]
+    mark_filtering_set = None
+    if flag & 0x10:
+        mark_filtering_set = struct.unpack_from(">H", data, lookup + 6 + count * 2)[0]
+    flag = _lookup_flag(flag, mark_filtering_set)
+    if lookup_type == EXTENSION_TYPES[tag]:
+        exts = [struct.unpack_from(">HHL", data, o) for o in offsets]
+        if not exts:
+            return lookup_type, flag, []
+        lookup_type = exts[0][1]
+        offsets = [o + ext[2] for o, ext in zip(offsets, exts)]
+    return lookup_type, flag, offsets
+
+
+def flatten_lookup(ttFont, tag, lookup):
+    """Flatten a lookup into a dict of records. Like shaping, the first
+    subtable which has a record wins."""
+    records = {}
+    glyph_order = ttFont.getGlyphOrder()
+    flatten = _gsub_records if tag == "GSUB" else _gpos_records
+    for st in lookup.SubTable:
+        lookup_type = lookup.LookupType
+        if lookup_type == EXTENSION_TYPES[tag]:
+            lookup_type = st.ExtensionLookupType
+            st = st.ExtSubTable
+        flatten(records, lookup_type, st, glyph_order)
+    flag = _lookup_flag(lookup.LookupFlag, getattr(lookup, "MarkFilteringSet", None))
+    return _with_flag(records, flag)
+
+
+def feature_lookups(table):
+    """Map (script, language, feature) to the indexes of its lookups"""
+    res = {}
+    if not table.ScriptList or not table.FeatureList:
+        return res
+    features = table.FeatureList.FeatureRecord
+    for script in table.ScriptList.ScriptRecord:
+        langsys = [("dflt", script.Script.DefaultLangSys)]
+        langsys += [
+            (r.LangSysTag.strip(), r.LangSys) for r in script.Script.LangSysRecord
+        ]
+        for lang, ls in langsys:
+            if ls is None:
+                continue
+            indexes = list(ls.FeatureIndex)
+            if ls.ReqFeatureIndex != 0xFFFF:
+                indexes.append(ls.ReqFeatureIndex)
+            for idx in indexes:
+                rec = features[idx]
+                key = (script.ScriptTag, lang, rec.FeatureTag)
+                res.setdefault(key, []).extend(rec.Feature.LookupListIndex)
+    return res
+
+
+class Layout:
+    def __init__(self, ttFont, tag):
+        """Flattened records of a GSUB or GPOS table"""
+        self.ttFont = ttFont
+        self.tag = tag
+        self.data = None
+        self.table = None
+        if tag in ttFont and not ttFont.isLoaded(tag) and ttFont.reader is not None:
+            # Lazily load the table so only the lookups which are used
+            # and aren't read from the raw bytes are decompiled
+            self.data = ttFont.reader[tag]
+            self.table = TTFont(ttFont.reader.file, lazy=True)[tag].table
+        elif tag in ttFont:
+            self.table = ttFont[tag].table
+        self.features = feature_lookups(self.table) if self.table else {}
+        self.lookup_count = (
+            len(self.table.LookupList.Lookup)
+            if self.table and self.table.LookupList
+            else 0
+        )
+        self._lookups = {}
+        self._records = {}
+
+    def lookup_flags(self):
+        """The LookupFlag of each lookup, or None for lookups without flags"""
+        if not self.lookup_count:
+            return []
+        if self.data is not None:
+            return [_raw_lookup_subtables(self.data, self.tag, i)[1] for i in range(self.lookup_count)]
+        return [
+            _lookup_flag(lookup.LookupFlag, getattr(lookup, "MarkFilteringSet", None))
+            for lookup in self.table.LookupList.Lookup[: self.lookup_count]
+        ]
+
+    def lookup(self, idx):
+        if idx not in self._lookups:
+            self._lookups[idx] = self._flatten(idx)
+        return self._lookups[idx]
+
+    def _flatten(self, idx):
+        if self.data is not None and self.tag == "GPOS":
+            lookup_type, flag, offsets = _raw_lookup_subtables(self.data, self.tag, idx)
+            if lookup_type == 2:
+                records = {}
+                glyph_order = self.ttFont.getGlyphOrder()
+                for offset in offsets:
+                    _raw_pair_pos(records, self.data, offset, glyph_order)
+                return _with_flag(records, flag)
+        return flatten_lookup(self.ttFont, self.tag, self.table.LookupList.Lookup[idx])
+
+    def records(self, key):
+        """All records for a (script, language, feature). Features which use
+        the same lookups share the same dict. Records which more than one
+        lookup has keep each lookup's value, see Stacked. GPOS values add
+        up and GSUB lookups apply to the previous lookup's output, so every
+        value affects shaping."""
+        # lookups are applied in lookup list order
+        lookups = tuple(sorted(set(self.features.get(key, ()))))
+        if len(lookups) == 1:
+            return self.lookup(lookups[0])
+        if lookups not in self._records:
+            res = {}
+            stacked = {}
+            for idx in lookups:
+                for k, v in self.lookup(idx).items():
+                    if k in res:
+                        stacked.setdefault(k, [res[k]]).append(v)
+                    else:
+                        res[k] = v
+            for k, values in stacked.items():
+                res[k] = Stacked(values)
+            self._records[lookups] = res
+        return self._records[lookups]
+
+
+def _record_name(key):
+    parts = [key[0]]
+    for item in key[1:]:
+        if isinstance(item, tuple):
+            parts.append(f"[{' '.join(item)}]")
+        else:
+            parts.append(str(item))
+    return " ".join(parts)
+
+
+def _record_value(value):
+    if value is None:
+        return None
+    if isinstance(value, Stacked):
+        return " + ".join(str(_record_value(v)) for v in value)
+    if isinstance(value, tuple):
+        return " ".join(str(v) for v in value)
+    return value
+
+
+def _record_glyphs(key, value, tag):
+    res = set()
+    # GSUB values are the glyphs substituted in
+    if tag == "GSUB":
+        for sub in value if isinstance(value, Stacked) else [value]:
+            if isinstance(sub, tuple):
+                res.update(sub)
+    for item in key[1:]:
+        if isinstance(item, tuple):
+            res.update(item)
+        elif isinstance(item, str) and not isinstance(item, LookupFlag):
+            res.add(item)
+    return res
+
+
+def substitution_sources(ttFont):
+    """Map each glyph which GSUB can substitute in to the glyphs it may be
+    substituted from. Every lookup is used, not just those in features."""
+    res = {}
+    layout = Layout(ttFont, "GSUB")
+    for idx in range(layout.lookup_count):
+        for key, value in layout.lookup(idx).items():
+            # contextual records don't substitute glyphs themselves
+            if not isinstance(value, tuple):
+                continue
+            sources = _record_glyphs(key, None, "GSUB")
+            for glyph in value:
+                res.setdefault(glyph, set()).update(sources)
+    return res
+
+
+class LayoutDiff:
+    def __init__(self, ttFont_a, ttFont_b, tags=("GSUB", "GPOS"), cache=None):
+        """Diff the GSUB and GPOS records of two fonts.
+
+        diff uses the same format as jfont.Diff, keyed by table then
+        "script/language/feature" then record. changed_glyphs are the
+        glyphs in records which have changed. cache is an optional
+        diffenator2.cache.DiskCache which keeps each table's diff."""
+        self.diff = {}
+        self.changed_glyphs = set()
+        same_order = ttFont_a.getGlyphOrder() == ttFont_b.getGlyphOrder()
+        for tag in tags:
+            if tag not in ttFont_a and tag not in ttFont_b:
+                continue
+            if (
+                same_order
+                and tag in ttFont_a
+                and tag in ttFont_b
+                and ttFont_a.getTableData(tag) == ttFont_b.getTableData(tag)
+            ):
+                continue
+            key = cached = None
+            if cache is not None:
+                key = cache.key(
+                    "layout diff", tag, table_key(ttFont_a, tag), table_key(ttFont_b, tag)
+                )
+                cached = cache.load(key)
+            if cached is None:
+                # collect the table's changed glyphs on their own so they
+                # can be cached with its diff
+                changed_glyphs, self.changed_glyphs = self.changed_glyphs, set()
+                table_diff = self._diff_table(
+                    tag, Layout(ttFont_a, tag), Layout(ttFont_b, tag)
+                )
+                cached = (table_diff, self.changed_glyphs)
+                self.changed_glyphs = changed_glyphs
+                if cache is not None:
+                    cache.store(key, cached)
+            table_diff, changed_glyphs = cached
+            self.changed_glyphs |= changed_glyphs
+            if table_diff:
+                self.diff[tag] = table_diff
+
+    def _diff_table(self, tag, layout_a, layout_b):
+        res = {}
+        seen = {}
+        for key in sorted(layout_a.features.keys() | layout_b.features.keys()):
+            records_a = layout_a.records(key)
+            records_b = layout_b.records(key)
+            # many languages use the same lookups
+            pair = (id(records_a), id(records_b))
+            if pair not in seen:
+                seen[pair] = self._diff_records(tag, records_a, records_b)
+            if seen[pair]:
+                res["/".join(key)] = seen[pair]
+        # Lookups which are only used by contextual lookups aren't in any
+        # feature so diff them by index
+        used = {
+            idx
+            for layout in (layout_a, layout_b)
+            for lookups in layout.features.values()
+            for idx in lookups
+        }
+        for idx in range(min(layout_a.lookup_count, layout_b.lookup_count)):
+            if idx in used:
+                continue
+            lookup_diff = self._diff_records(
+                tag, layout_a.lookup(idx), layout_b.lookup(idx)
+            )
+            if lookup_diff:
+                res[f"lookup {idx}"] = lookup_diff
+        return res
+
+    def _diff_records(self, tag, records_a, records_b):
+        if records_a == records_b:
+            return {}
+        keys_a, keys_b = records_a.keys(), records_b.keys()
+        changed = (keys_a ^ keys_b) | {
+            k for k in keys_a & keys_b if records_a[k] != records_b[k]
+        }
+        res = {}
+        for key in sorted(changed, key=_record_name):
+            value_a, value_b = records_a.get(key), records_b.get(key)
+            self.changed_glyphs |= _record_glyphs(key, value_a, tag)
+            self.changed_glyphs |= _record_glyphs(key, value_b, tag)
+            res[_record_name(key)] = [_record_value(value_a), _record_value(value_b)]
+        if len(res) >= MAX_CHANGES:
+            return {"error": (f"There are {len(res)} changes, check manually!", "")}
+        return res
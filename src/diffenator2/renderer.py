@@ -1,16 +1,20 @@
 from __future__ import annotations
 import argparse
 import logging
+import math
+import hashlib
 import uharfbuzz as hb
 from blackrenderer.render import (
     buildGlyphLine,
     scaleRect,
     insetRect,
+    offsetRect,
     calcGlyphLineBounds,
     intRect,
 )
 from blackrenderer.backends import getSurfaceClass
-from PIL import Image, ImageOps, ImageChops
+import skia
+from PIL import Image
 from diffenator2.font import DFont
 from diffenator2.utils import gen_gif
 import numpy as np
@@ -18,10 +22,22 @@ import freetype as ft
 from dataclasses import dataclass, field
 
 FONT_SIZE = 28
+# Number of horizontal and vertical subpixel positions a glyph can be
+# rasterized at. Each cached glyph tile is keyed on one of these offsets.
+SUBPIXEL_STEPS = 16
+RENDERERS = ("freetype", "skia")
 
 logger = logging.getLogger(__name__)
 
 
+def pick_backend(*fonts):
+    """FreeType is much faster but can only draw black-and-white glyphs.
+    Fonts with color tables need blackrenderer and Skia."""
+    if any(font.is_color() for font in fonts):
+        return "skia"
+    return "freetype"
+
+
 @dataclass
 class Renderer:
     font: DFont
@@ -31,16 +47,36 @@ class Renderer:
     variations: dict[str, float] = None
     lang: str = None
     script: str = None
-    cache: dict[int,any] = field(default_factory=dict)
+    cache: dict[tuple,any] = None
+    backend: str = None
 
+    def __post_init__(self):
+        # Glyph tiles are shared by all renderers for the same font
+        if self.cache is None:
+            self.cache = self.font.glyph_cache
+        if self.backend is None:
+            self.backend = pick_backend(self.font)
+        if self.backend not in RENDERERS:
+            raise ValueError(
+                f"Unknown renderer {self.backend}. Choose from {RENDERERS}"
+            )
+        self.set_variations(self.variations)
+        # Reused by every shape call, see shape
+        self._buf = hb.Buffer()
+
+    def set_variations(self, variations):
+        """Move the font to a location. The location is font state, so all
+        renderers for a font draw it at the last location set."""
+        self.variations = variations
+        if variations:
+            self.font.set_variations(variations)
 
     def shape(self, text):
+        """Shape text. The renderer's buffer is returned and it's reused,
+        so the next shape call overwrites it."""
         hb_font = self.font.hbFont
-        if self.variations:
-            hb_font.set_variations(self.variations)
-        hb.ot_font_set_funcs(hb_font)
-
-        buf = hb.Buffer()
+        buf = self._buf
+        buf.clear_contents()
         buf.add_str(text)
         buf.guess_segment_properties()
 
@@ -53,16 +89,102 @@ class Renderer:
         return buf
 
     def render(self, text):
-        # See render_text_ft below
-        return self.render_text_cairo(text)
+        return _to_image(self.draw(text))
+
+    def draw(self, text):
+        """Lay out text as glyph tiles without drawing an image, see
+        Drawing. Returns None if there's nothing to draw."""
+        if self.backend == "freetype":
+            return self.draw_text_ft(text)
+        return self.draw_text_atlas(text)
+
+    def render_text_atlas(self, text):
+        """Render text by compositing glyph tiles from the glyph cache.
+
+        Produces the same image as render_text_cairo but each glyph is only
+        rasterized once per location, size and subpixel offset."""
+        return _to_image(self.draw_text_atlas(text))
+
+    def draw_text_atlas(self, text):
+        font = self.font.blackFont
+        glyphNames = font.glyphNames
+
+        scaleFactor = self.font_size / font.unitsPerEm
+
+        buf = self.shape(text)
+
+        glyphLine = buildGlyphLine(buf.glyph_infos, buf.glyph_positions, glyphNames)
+        orig_bounds = calcGlyphLineBounds(glyphLine, font)
+        extents = self.font.hbFont.get_font_extents(buf.direction)
+        left_edge = (min(0, orig_bounds[0], orig_bounds[2]) - self.margin) * scaleFactor
+        bounds = (
+            min(0, orig_bounds[0], orig_bounds[2]),
+            min(extents.descender, extents.ascender),
+            max(orig_bounds[0], orig_bounds[2]),
+            max(extents.descender, extents.ascender),
+        )
+        bounds = scaleRect(bounds, scaleFactor, scaleFactor)
+        bounds = insetRect(bounds, -self.margin, -self.margin)
+        bounds = intRect(bounds)
+        if orig_bounds[0] == orig_bounds[2] or \
+            orig_bounds[1] == orig_bounds[3]:
+            return None
+
+        tiles = []
+        x, y = 0, 0
+        for glyph in glyphLine:
+            # glyph origin in pixels, split into a whole pixel position
+            # and a quantized subpixel offset
+            px, sub_x = _split_subpixel((x + glyph.xOffset) * scaleFactor)
+            py, sub_y = _split_subpixel((y + glyph.yOffset) * scaleFactor)
+            tile = self.glyph_tile(glyph.name, glyph.gid, scaleFactor, sub_x, sub_y)
+            if tile is not None:
+                pixels, tile_x, tile_y, digest = tile
+                tiles.append((pixels, px + tile_x, py + tile_y, digest))
+            x += glyph.xAdvance
+            y += glyph.yAdvance
+        return Drawing(tiles, bounds, left_edge)
+
+    def glyph_tile(self, name, gid, scaleFactor, sub_x, sub_y):
+        """Return a cached (pixels, left, top, digest) tile for a glyph drawn
+        at a subpixel offset. left and top are the pixel offsets of the
+        tile's top left corner from the glyph origin (y up)."""
+        # keyed on the location the font is drawn at, which other renderers
+        # for the font may have set
+        key = (
+            self.font._normalized_location(),
+            self.font_size,
+            gid,
+            sub_x,
+            sub_y,
+        )
+        if key in self.cache:
+            return self.cache[key]
+        font = self.font.blackFont
+        glyph_bounds = font.getGlyphBounds(name)
+        if glyph_bounds is None:
+            self.cache[key] = None
+            return None
+        glyph_bounds = scaleRect(glyph_bounds, scaleFactor, scaleFactor)
+        glyph_bounds = offsetRect(glyph_bounds, sub_x / SUBPIXEL_STEPS, sub_y / SUBPIXEL_STEPS)
+        # pad by a pixel so antialiased edges are never clipped
+        glyph_bounds = insetRect(intRect(glyph_bounds), -1, -1)
+        surface = getSurfaceClass("skia", ".png")()
+        with surface.canvas(glyph_bounds) as canvas:
+            canvas.translate(sub_x / SUBPIXEL_STEPS, sub_y / SUBPIXEL_STEPS)
+            canvas.scale(scaleFactor)
+            font.drawGlyph(name, canvas)
+        # tiles are composited, so they're kept premultiplied
+        pixels = surface._image.toarray(alphaType=skia.AlphaType.kPremul_AlphaType)
+        tile = (pixels, glyph_bounds[0], glyph_bounds[3], _digest(pixels))
+        self.cache[key] = tile
+        return tile
 
     def render_text_cairo(self, text):
         font = self.font.blackFont
         glyphNames = font.glyphNames
 
         scaleFactor = self.font_size / font.unitsPerEm
-        if self.variations:
-            font.setLocation(self.variations)
 
         buf = self.shape(text)
 
@@ -99,52 +221,126 @@ class Renderer:
                 canvas.translate(glyph.xAdvance, glyph.yAdvance)
         return Image.fromarray(surface._image.toarray()), left_edge
 
-    # This code was an attempt to render black-and-white fonts
-    # quickly using Freetype and numpy. It was very fast and very
-    # clever, but there were various things we couldn't get working
-    # (in particular, vertical placement of glyphs with offsets)
-    # so we've parked it for now.
-
-    # def render_text_ft(self, text: str):
-    #     ft_face = self.font.ftFont
-    #     ft_face.set_char_size(self.font_size * 64)
-    #     buf = self.shape(text)
-    #     pen = ft.FT_Vector(0, 0)
-    #     xmin, xmax = 0, 0
-    #     ymin, ymax = 0, 0
-
-    #     if not buf.glyph_infos or not buf.glyph_positions:
-    #         logger.error("Shaping failed for string '%s'", textString)
-    #         return np.array([])
-
-    #     for glyph, pos in zip(buf.glyph_infos, buf.glyph_positions):
-    #         bitmap = get_cached_bitmap(ft_face, glyph.codepoint, self.cache)
-    #         width = bitmap.width
-    #         rows = bitmap.rows
-    #         x0 = (pen.x >> 6) + bitmap.left + (pos.x_offset >> 6)
-    #         x1 = x0 + width
-    #         y0 = (pen.y >> 6) - (bitmap.rows - bitmap.top) + (pos.y_offset >> 6)
-    #         y1 = y0 + rows
-    #         xmin, xmax = min(xmin, x0), max(xmax, x1)
-    #         ymin, ymax = min(ymin, y0), max(ymax, y1)
-    #         pen.x += pos.x_advance
-    #         pen.y += pos.y_advance
-
-    #     L = np.zeros((ymax - ymin, xmax - xmin), dtype=np.ubyte)
-    #     pen.x, pen.y = 0, 0
-    #     for glyph, pos in zip(buf.glyph_infos, buf.glyph_positions):
-    #         bitmap = get_cached_bitmap(ft_face, glyph.codepoint, self.cache)
-    #         x = (pen.x >> 6) - xmin + bitmap.left + (pos.x_offset >> 6)
-    #         y = (pen.y >> 6) - ymin - (bitmap.rows - bitmap.top) + (pos.y_offset >> 6)
-    #         data = []
-    #         for j in range(bitmap.rows):
-    #             data.extend(bitmap.buffer[j * bitmap.pitch : j * bitmap.pitch + bitmap.width])
-    #         if len(data):
-    #             Z = np.array(data, dtype=np.ubyte).reshape(bitmap.rows, bitmap.width)
-    #             L[y : y + bitmap.rows, x : x + bitmap.width] |= Z
-    #         pen.x += pos.x_advance
-    #         pen.y += pos.y_advance
-    #     return Image.fromarray(L)
+    def render_text_ft(self, text):
+        """Render black-and-white fonts using FreeType and numpy.
+
+        Glyph bitmaps are cached per location, size and subpixel offset and
+        placed using the HarfBuzz positions, so the output lines up with
+        render_text_atlas."""
+        return _to_image(self.draw_text_ft(text))
+
+    def draw_text_ft(self, text):
+        ft_face = self.font.ftFont
+        ft_face.set_char_size(self.font_size * 64)
+        scaleFactor = self.font_size / ft_face.units_per_EM
+
+        buf = self.shape(text)
+        if not buf.glyph_infos or not buf.glyph_positions:
+            logger.error("Shaping failed for string '%s'", text)
+            return None
+
+        tiles = []
+        x, y = 0, 0
+        for info, pos in zip(buf.glyph_infos, buf.glyph_positions):
+            px, sub_x = _split_subpixel((x + pos.x_offset) * scaleFactor)
+            py, sub_y = _split_subpixel((y + pos.y_offset) * scaleFactor)
+            key = (
+                "ft",
+                self.font._normalized_location(),
+                self.font_size,
+                info.codepoint,
+                sub_x,
+                sub_y,
+            )
+            bitmap = get_cached_bitmap(ft_face, info.codepoint, self.cache, key, sub_x, sub_y)
+            if bitmap.width and bitmap.rows:
+                tiles.append(
+                    (bitmap.buffer, px + bitmap.left, py + bitmap.top, bitmap.digest)
+                )
+            x += pos.x_advance
+            y += pos.y_advance
+        if not tiles:
+            return None
+
+        # Like render_text_atlas, the image spans the glyph line horizontally
+        # and the font's ascender and descender vertically.
+        extents = self.font.hbFont.get_font_extents(buf.direction)
+        xMin = min(0, min(tile[1] for tile in tiles)) - self.margin
+        xMax = max(pixels.shape[1] + x for pixels, x, _, _ in tiles) + self.margin
+        yMin = math.floor(min(extents.descender, extents.ascender) * scaleFactor) - self.margin
+        yMax = math.ceil(max(extents.descender, extents.ascender) * scaleFactor) + self.margin
+        return Drawing(tiles, (xMin, yMin, xMax, yMax), xMin)
+
+
+@dataclass
+class Drawing:
+    """Glyph tiles laid out in pixels, y up. Each tile is (premultiplied
+    RGBA pixels, x, y, digest) where x, y is the tile's top left corner and
+    digest is a hash of its pixels. bounds is the (xMin, yMin, xMax, yMax)
+    box of the image and left is the x position render returns."""
+    tiles: list[tuple[np.ndarray, int, int, bytes]]
+    bounds: tuple[int, int, int, int]
+    left: float
+
+    def paint(self, dst, xMin, yMax):
+        """Draw the tiles onto dst, whose top left corner is at xMin, yMax"""
+        for pixels, x, y, _ in self.tiles:
+            _composite(dst, pixels, x - xMin, yMax - y)
+
+    def signature(self):
+        """Drawings with the same signature paint the same image"""
+        return self.bounds, [(digest, x, y) for _, x, y, digest in self.tiles]
+
+
+def same_drawing(drawing_a, drawing_b):
+    if drawing_a is None or drawing_b is None:
+        return drawing_a is drawing_b
+    return drawing_a.signature() == drawing_b.signature()
+
+
+def _to_image(drawing):
+    if drawing is None:
+        return Image.new("RGBA", (0,0)), 0
+    xMin, yMin, xMax, yMax = drawing.bounds
+    img = np.zeros((yMax - yMin, xMax - xMin, 4), dtype=np.uint8)
+    drawing.paint(img, xMin, yMax)
+    return Image.fromarray(_unpremultiply(img)), drawing.left
+
+
+def _unpremultiply(pixels):
+    """Premultiplied RGBA pixels as the straight alpha pixels PIL expects"""
+    alpha = pixels[..., 3:4].astype(np.uint32)
+    rgb = (pixels[..., :3] * np.uint32(255) + alpha // 2) // np.maximum(alpha, 1)
+    res = pixels.copy()
+    res[..., :3] = np.minimum(rgb, 255)
+    return res
+
+
+def _digest(pixels):
+    return hashlib.blake2b(
+        repr(pixels.shape).encode("utf8") + pixels.tobytes(), digest_size=16
+    ).digest()
+
+
+def _split_subpixel(value):
+    """Split a pixel coordinate into a whole pixel and a subpixel step"""
+    steps = round(value * SUBPIXEL_STEPS)
+    return steps // SUBPIXEL_STEPS, steps % SUBPIXEL_STEPS
+
+
+def _composite(dst, src, x, y):
+    """Draw premultiplied RGBA src over dst with its top left corner at x, y"""
+    height, width = dst.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + src.shape[1], width), min(y + src.shape[0], height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    src = src[y0 - y : y1 - y, x0 - x : x1 - x].astype(np.uint16)
+    region = dst[y0:y1, x0:x1]
+    inv_alpha = 255 - src[..., 3:4]
+    blended = src + (region * inv_alpha + 127) // 255
+    region[...] = np.minimum(blended, 255)
+
 
 @dataclass
 class Bitmap:
@@ -154,22 +350,37 @@ class Bitmap:
     top: int
     left: int
     pitch: int
-
-def get_cached_bitmap(ft_face, codepoint, cache):
-    if codepoint in cache:
-        return cache[codepoint]
+    digest: bytes = None
+
+def get_cached_bitmap(ft_face, codepoint, cache, key=None, sub_x=0, sub_y=0):
+    """Load a glyph bitmap as a premultiplied black RGBA array. The glyph
+    is shifted by sub_x, sub_y subpixel steps before rasterizing."""
+    key = codepoint if key is None else key
+    if key in cache:
+        return cache[key]
+    delta = ft.FT_Vector(
+        sub_x * 64 // SUBPIXEL_STEPS, sub_y * 64 // SUBPIXEL_STEPS
+    )
+    ft_face.set_transform(ft.FT_Matrix(0x10000, 0, 0, 0x10000), delta)
     flags = ft.FT_LOAD_NO_HINTING | ft.FT_LOAD_RENDER
     ft_face.load_glyph(codepoint, flags)
     bitmap = ft_face.glyph.bitmap
-    cache[codepoint] = Bitmap(
-        buffer=bitmap.buffer,
+    alpha = np.zeros((bitmap.rows, bitmap.width), dtype=np.uint8)
+    if bitmap.rows and bitmap.width:
+        data = np.array(bitmap.buffer, dtype=np.uint8).reshape(bitmap.rows, bitmap.pitch)
+        alpha[...] = data[:, :bitmap.width]
+    rgba = np.zeros((bitmap.rows, bitmap.width, 4), dtype=np.uint8)
+    rgba[..., 3] = alpha
+    cache[key] = Bitmap(
+        buffer=rgba,
         width = bitmap.width,
         rows = bitmap.rows,
         top = ft_face.glyph.bitmap_top,
         left = ft_face.glyph.bitmap_left,
         pitch = ft_face.glyph.bitmap.pitch,
+        digest = _digest(rgba),
     )
-    return cache[codepoint]
+    return cache[key]
 
 
 @dataclass
@@ -180,8 +391,12 @@ class PixelDiffer:
     lang=None
     features=None
     font_size: int = FONT_SIZE
+    renderer: str = None
 
     def __post_init__(self):
+        # Both fonts must be drawn by the same backend to be comparable
+        if self.renderer is None:
+            self.renderer = pick_backend(self.font_a, self.font_b)
         self.renderer_a = Renderer(
             self.font_a,
             font_size=self.font_size,
@@ -189,7 +404,8 @@ class PixelDiffer:
             features=self.features,
             script=self.script,
             lang=self.lang,
-            variations=getattr(self.font_a, "variations", None)
+            variations=getattr(self.font_a, "variations", None),
+            backend=self.renderer,
         )
         self.renderer_b = Renderer(
             self.font_b,
@@ -198,7 +414,8 @@ class PixelDiffer:
             features=self.features,
             script=self.script,
             lang=self.lang,
-            variations=getattr(self.font_b, "variations", None)
+            variations=getattr(self.font_b, "variations", None),
+            backend=self.renderer,
         )
 
     def set_script(self, script):
@@ -213,49 +430,160 @@ class PixelDiffer:
         self.renderer_a.features = features
         self.renderer_b.features = features
 
-    def diff(self, string):
-        img_a, left_a = self.renderer_a.render(string)
-        img_b, left_b = self.renderer_b.render(string)
-        if img_a.size == (0, 0) and img_b.size != (0, 0):
-            return 99.99, []
-        if img_b.size == (0, 0) and img_a.size != (0, 0):
-            return 99.99, []
-        if img_a.size != img_b.size:
-            biggest = list(map(max, zip(img_a.size, img_b.size)))
-            # Pad to largest size, anchored at the middle of the left hand side
-            img_a = ImageOps.pad(img_a, biggest, centering=(0, 0.5))
-            img_b = ImageOps.pad(img_b, biggest, centering=(0, 0.5))
-
-        # Align images at X=0 origin
-        lsb_diff = int(left_a - left_b)
-        if (left_a < 0 or left_b < 0) and lsb_diff != 0:
-            if lsb_diff > 0:
-                img_b = ImageChops.offset(img_b, -lsb_diff, 0)
-            elif lsb_diff < 0:
-                img_a = ImageChops.offset(img_a, lsb_diff, 0)
-
-        img_a = np.asarray(img_a)
-        img_b = np.asarray(img_b)
-
-        diff_map = np.abs(img_a-img_b)
-        if np.size(diff_map) == 0:
-            return 0, []
-        pc = np.sum(diff_map) / np.size(diff_map)
-        # Store in case others want them
-        self.img_a = Image.fromarray(img_a)
-        self.img_b = Image.fromarray(img_b)
-        return pc, diff_map
+    def set_variations(self, coords):
+        self.renderer_a.set_variations(coords)
+        self.renderer_b.set_variations(coords)
+
+    def result_key(self, buf_a, buf_b):
+        """Key of the result of diffing two shaped runs in the fonts' disk
+        cache, or None if results can't be cached. The key covers the
+        glyphs' outlines and positions and the font extents, which decide
+        how the runs are drawn, so it's unchanged by edits to other glyphs
+        or tables."""
+        disk = self.font_a.disk_cache
+        if disk is None:
+            return None
+        fonts = (self.font_a, self.font_b)
+        # Color glyphs aren't drawn from their outlines. Outlines of rescaled
+        # fonts are hashed after rescaling but drawn from the original data.
+        if any(
+            f.is_color() or f.ttFont["head"].unitsPerEm != f.hbFont.face.upem
+            for f in fonts
+        ):
+            return None
+        return disk.key(
+            "pixel diff",
+            self.renderer,
+            self.font_size,
+            _run_key(self.font_a, buf_a),
+            _run_key(self.font_b, buf_b),
+        )
+
+    def cached_result(self, key):
+        """(changed pixels, changed box) from the disk cache or None"""
+        if key is None:
+            return None
+        return self.font_a.disk_cache.load(key)
+
+    def store_result(self, key, result):
+        if key is not None:
+            self.font_a.disk_cache.store(key, result)
+
+    def shape(self, string):
+        """Shape string with both fonts, see Renderer.shape"""
+        return self.renderer_a.shape(string), self.renderer_b.shape(string)
+
+    def draw(self, string):
+        """Lay out string with both fonts, see Renderer.draw"""
+        self.string = string
+        return self.renderer_a.draw(string), self.renderer_b.draw(string)
+
+    def _paint(self, drawing_a, drawing_b):
+        """Paint both drawings into a buffer which spans them, with their
+        origins at the same pixel. Returns views of the images and a scratch
+        image of the same size."""
+        if drawing_a is None:
+            bounds = (0, 0, 0, 0)
+        else:
+            bounds = (
+                min(drawing_a.bounds[0], drawing_b.bounds[0]),
+                min(drawing_a.bounds[1], drawing_b.bounds[1]),
+                max(drawing_a.bounds[2], drawing_b.bounds[2]),
+                max(drawing_a.bounds[3], drawing_b.bounds[3]),
+            )
+        xMin, yMin, xMax, yMax = bounds
+        height, width = yMax - yMin, xMax - xMin
+        # The buffer only grows, so most diffs don't allocate
+        buf = getattr(self, "_pixels", None)
+        if buf is None or buf.shape[1] < height or buf.shape[2] < width:
+            shape = (3, height, width, 4)
+            if buf is not None:
+                shape = (3, max(height, buf.shape[1]), max(width, buf.shape[2]), 4)
+            buf = self._pixels = np.empty(shape, dtype=np.uint8)
+        img_a, img_b, scratch = buf[:, :height, :width]
+        img_a[...] = 0
+        img_b[...] = 0
+        if drawing_a is not None:
+            drawing_a.paint(img_a, xMin, yMax)
+            drawing_b.paint(img_b, xMin, yMax)
+        return img_a, img_b, scratch
+
+    def diff(self, string, drawings=None):
+        """Return the percentage the inked pixels have changed by and the
+        (left, top, right, bottom) box of the changed pixels, or None if no
+        pixels changed. A pixel is inked if it's drawn in either image and
+        its change is the largest of its channels' absolute differences,
+        which is the alpha difference for black glyphs. drawings are from draw(string), pass them to
+        skip laying out the string again. The images aren't kept, debug_gif
+        draws the last string again."""
+        if drawings is None:
+            drawings = self.draw(string)
+            # Drawings with the same tiles at the same positions don't need
+            # to be painted. Callers which pass drawings have checked this.
+            if same_drawing(*drawings):
+                return 0, None
+        drawing_a, drawing_b = drawings
+        if (drawing_a is None) != (drawing_b is None):
+            return 99.99, None
+        img_a, img_b, scratch = self._paint(drawing_a, drawing_b)
+        # |a - b| without the uint8 subtraction wrapping around
+        np.minimum(img_a, img_b, out=scratch)
+        np.maximum(img_a, img_b, out=img_a)
+        # Scoring against the ink, not the whole image, keeps the score from
+        # shrinking with the margins and the space around the glyphs
+        inked = np.count_nonzero(img_a[..., 3])
+        diff_map = np.subtract(img_a, scratch, out=img_a)
+        total = int(diff_map.max(axis=2).sum(dtype=np.uint64))
+        if total == 0:
+            return 0, None
+        return 100 * total / (255 * inked), changed_box(diff_map)
 
     def debug_gif(self, fp):
-        img_a = self.img_a.convert('RGBA')
+        drawing_a, drawing_b = self.draw(self.string)
+        if (drawing_a is None) != (drawing_b is None):
+            # one of the fonts didn't draw anything
+            img_a, _ = _to_image(drawing_a)
+            img_b, _ = _to_image(drawing_b)
+            size = tuple(map(max, zip(img_a.size, img_b.size)))
+            img_a = Image.new('RGBA', size) if img_a.size == (0, 0) else img_a
+            img_b = Image.new('RGBA', size) if img_b.size == (0, 0) else img_b
+        else:
+            images = self._paint(drawing_a, drawing_b)
+            img_a = Image.fromarray(_unpremultiply(images[0]))
+            img_b = Image.fromarray(_unpremultiply(images[1]))
+        img_a = img_a.convert('RGBA')
         img_a_background = Image.new('RGBA', img_a.size, (255,255,255))
         img_a = Image.alpha_composite(img_a_background, img_a)
-        img_b = self.img_b.convert('RGBA')
+        img_b = img_b.convert('RGBA')
         img_b_background = Image.new('RGBA', img_b.size, (255,255,255))
         img_b = Image.alpha_composite(img_b_background, img_b)
         gen_gif(img_a, img_b, fp)
 
 
+def _run_key(font, buf):
+    glyph_order = font.ttFont.getGlyphOrder()
+    extents = font.hbFont.get_font_extents(buf.direction)
+    return (
+        font.hbFont.face.upem,
+        extents.ascender,
+        extents.descender,
+        [
+            (font.glyph_hash(glyph_order[info.codepoint]), pos.position)
+            for info, pos in zip(buf.glyph_infos, buf.glyph_positions)
+        ],
+    )
+
+
+def changed_box(diff_map):
+    """(left, top, right, bottom) box of the non zero pixels in a diff map"""
+    changed = diff_map.any(axis=2) if diff_map.ndim == 3 else diff_map != 0
+    rows = np.flatnonzero(changed.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(changed.any(axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Draw some text")
     parser.add_argument("font", metavar="TTF")
@@ -266,6 +594,7 @@ if __name__ == "__main__":
     parser.add_argument("--features", metavar="FEATURES")
     parser.add_argument("--variations", metavar="VARIATIONS")
     parser.add_argument("-pt", help="point size", default=250, type=int)
+    parser.add_argument("--renderer", choices=RENDERERS, default=None)
     # TODO add variations
     args = parser.parse_args()
 
@@ -288,12 +617,13 @@ if __name__ == "__main__":
             axis, loc = f.split("=")
             variations[axis] = float(loc)
 
-    img = Renderer(
+    img, _ = Renderer(
         font,
         features=features,
         lang=args.lang,
         script=args.script,
         font_size=args.pt,
-        variations=variations
+        variations=variations,
+        backend=args.renderer,
     ).render(args.string)
     img.save(args.out)
@@ -112,36 +112,48 @@ class ScreenShotter:
             browser.quit()
 
 
-def screenshot_dir(
-        dir_fp: str,
-        out: str,
-        skip=[
-            "diffbrowsers_proofer.html",
-            "diffenator.html",
-            "diffbrowsers_user_strings.html"
-        ],
-):
+SKIP_DOCS = [
+    "diffbrowsers_proofer.html",
+    "diffenator.html",
+    "diffbrowsers_user_strings.html",
+]
+
+
+def screenshot_dir(dir_fp: str, out: str, skip=SKIP_DOCS):
     """Screenshot a folder of html docs. Walk the damn things"""
-    if not os.path.exists(out):
-        os.mkdir(out)
+    files = [
+        os.path.join(dirpath, filename)
+        for dirpath, _, filenames in os.walk(dir_fp)
+        for filename in filenames
+    ]
+    return screenshot_files(files, dir_fp, out, skip)
+
+
+def screenshot_files(files, dir_fp: str, out: str, skip=SKIP_DOCS):
+    """Screenshot the html docs in files, which are in dir_fp. Images are
+    named after each doc's path relative to dir_fp. Returns the paths of
+    the images."""
+    os.makedirs(out, exist_ok=True)
+    images = []
     screenshotter = ScreenShotter()
-    for dirpath, _, filenames in os.walk(dir_fp):
-        for filename in filenames:
-            if not filename.endswith(".html") or any([s in filename for s in skip]):
-                continue
-            fp = os.path.join(dirpath, filename)
-            fp = os.path.abspath(fp)
-            url = f"file:///{fp}"
-            img_prefix_fp = (
-                os.path.relpath(fp, dir_fp)
-                .replace(os.path.sep, "-")
-                .replace(".html", "")
-            )
-            with tempfile.TemporaryDirectory() as tmp:
-                screenshotter.take(url, tmp)
-                for f in os.listdir(tmp):
-                    if not f.endswith(("png", "gif")):
-                        continue
-                    src = os.path.join(tmp, f)
-                    dst = os.path.join(out, f"{img_prefix_fp}-{f}")
-                    shutil.move(src, dst)
+    for fp in files:
+        filename = os.path.basename(fp)
+        if not filename.endswith(".html") or any([s in filename for s in skip]):
+            continue
+        fp = os.path.abspath(fp)
+        url = f"file:///{fp}"
+        img_prefix_fp = (
+            os.path.relpath(fp, dir_fp)
+            .replace(os.path.sep, "-")
+            .replace(".html", "")
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            screenshotter.take(url, tmp)
+            for f in os.listdir(tmp):
+                if not f.endswith(("png", "gif")):
+                    continue
+                src = os.path.join(tmp, f)
+                dst = os.path.join(out, f"{img_prefix_fp}-{f}")
+                shutil.move(src, dst)
+                images.append(dst)
+    return images
@@ -2,8 +2,12 @@
 # https://github.com/justvanrossum/fontgoggles/blob/master/Lib/fontgoggles/misc/segmenting.py
 # TODO: write python bindings for ribraqm instead
 import itertools
-from fontTools.unicodedata import script
+import json
+import os
+from functools import lru_cache
+from fontTools.unicodedata import script, Scripts
 from unicodedata2 import category
+import numpy as np
 
 # Monkeypatch bidi to use unicodedata2
 import unicodedata2
@@ -24,7 +28,23 @@ from fontTools.unicodedata.OTTags import SCRIPT_EXCEPTIONS
 UNKNOWN_SCRIPT = {"Zinh", "Zyyy", "Zxxx"}
 
 
+# Bidi types which can give part of a string an odd (right to left) or
+# raised level. Strings without them are left to right at level 0.
+RTL_BIDI_TYPES = {
+    "R", "AL", "AN", "LRE", "LRO", "RLE", "RLO", "PDF", "LRI", "RLI", "FSI", "PDI",
+}
+
+
 def textSegments(txt):
+    # Most words are left to right so skip the bidi algorithm for them
+    if RTL_BIDI_TYPES.isdisjoint(map(unicodedata2.bidirectional, txt)):
+        return _segments(txt, detectScript(txt), [0] * len(txt)), 0
+    segments, baseLevel = _bidiTextSegments(txt)
+    return list(segments), baseLevel
+
+
+@lru_cache(maxsize=1 << 16)
+def _bidiTextSegments(txt):
     scripts = detectScript(txt)
     storage = getBiDiInfo(txt)
 
@@ -39,13 +59,18 @@ def textSegments(txt):
         else:
             prevLevel = level
 
+    return tuple(_segments(txt, scripts, levels)), storage['base_level']
+
+
+def _segments(txt, scripts, levels):
+    keys = [SCRIPT_EXCEPTIONS.get(s, s.lower()) for s in scripts]
+    if txt and len(set(zip(keys, levels))) == 1:
+        return [(txt, scripts[0], levels[0], 0)]
+
     chars = list(zip(txt, scripts, levels))
 
     runLenghts = []
-    for value, sub in itertools.groupby(
-        chars,
-        key=lambda item: (SCRIPT_EXCEPTIONS.get(item[1], item[1].lower()), item[2]),
-    ):
+    for value, sub in itertools.groupby(zip(keys, levels)):
         runLenghts.append(len(list(sub)))
 
     segments = []
@@ -57,7 +82,7 @@ def textSegments(txt):
         _, script, bidiLevel = segment[0]
         segments.append((runChars, script, bidiLevel, index))
         index = nextIndex
-    return segments, storage['base_level']
+    return segments
 
 
 def reorderedSegments(segments, baseLevel):
@@ -112,6 +137,182 @@ def detectScript(txt):
     return charScript
 
 
+# Scripts and categories as array values. detectScripts and segmentArrays
+# return scripts as indexes into SCRIPTS.
+SCRIPTS = sorted(set(Scripts.VALUES) | {"Zxxx"})
+CATEGORIES = sorted(
+    "Cc Cf Cn Co Cs Ll Lm Lo Lt Lu Mc Me Mn Nd Nl No Pc Pd Pe Pf Pi Po Ps "
+    "Sc Sk Sm So Zl Zp Zs".split()
+)
+
+# Scripts which are segmented together have the same key, like textSegments
+_keys = {}
+SCRIPT_KEYS = np.array(
+    [_keys.setdefault(SCRIPT_EXCEPTIONS.get(s, s.lower()), len(_keys)) for s in SCRIPTS]
+)
+
+
+# Category and RTL ranges, built by scripts/build_wordlist_index.py
+UNICODE_TABLES = os.path.join(os.path.dirname(__file__), "data", "unicode_tables.json")
+
+
+def _expand(starts, values, dtype):
+    """A value for every codepoint from the ranges' starts and values"""
+    starts = np.array(list(starts) + [0x110000])
+    return np.repeat(np.array(values, dtype=dtype), np.diff(starts))
+
+
+@lru_cache(maxsize=None)
+def _unicodeTables():
+    """The script, category and whether the bidi type is in RTL_BIDI_TYPES
+    of every codepoint. Built once per process."""
+    scripts = _expand(
+        Scripts.RANGES, [SCRIPTS.index(v) for v in Scripts.VALUES], np.uint8
+    )
+    tables = _loadUnicodeTables()
+    if tables is None:
+        tables = _scanUnicode()
+    return (scripts, *tables)
+
+
+def _loadUnicodeTables():
+    """The category and RTL tables from UNICODE_TABLES, or None if they're
+    missing or were built from other unicode data"""
+    if not os.path.exists(UNICODE_TABLES):
+        return None
+    with open(UNICODE_TABLES, encoding="utf8") as doc:
+        data = json.load(doc)
+    if data["unicode"] != unicodedata2.unidata_version or data["categories"] != CATEGORIES:
+        return None
+    return (
+        _expand(data["category_starts"], data["category_values"], np.uint8),
+        _expand(data["rtl_starts"], data["rtl_values"], bool),
+    )
+
+
+def _scanUnicode():
+    # Looking up every codepoint takes a couple of seconds, so this is only
+    # used when UNICODE_TABLES is out of date
+    categories = np.empty(0x110000, dtype=np.uint8)
+    rtl = np.empty(0x110000, dtype=bool)
+    cat_index = {c: i for i, c in enumerate(CATEGORIES)}
+    for u in range(0x110000):
+        c = chr(u)
+        categories[u] = cat_index[category(c)]
+        rtl[u] = unicodedata2.bidirectional(c) in RTL_BIDI_TYPES
+    return categories, rtl
+
+
+def compile_unicode_tables(dst=UNICODE_TABLES):
+    """Store the category and RTL tables as ranges so they don't have to be
+    built from unicodedata2 by every process"""
+    data = {"unicode": unicodedata2.unidata_version, "categories": CATEGORIES}
+    for name, values in zip(("category", "rtl"), _scanUnicode()):
+        values = values.astype(np.int16)
+        starts = np.flatnonzero(np.diff(values, prepend=-1))
+        data[f"{name}_starts"] = starts.tolist()
+        data[f"{name}_values"] = values[starts].tolist()
+    with open(dst, "w", encoding="utf8") as doc:
+        json.dump(data, doc, separators=(",", ":"))
+
+
+def _fill(values, sources, reverse=False):
+    """Replace each value with the value of the nearest source before it,
+    or after it if reverse. Each value must have a source."""
+    idx = np.arange(len(values))
+    if reverse:
+        idx = np.where(sources, idx, len(values))
+        idx = np.minimum.accumulate(idx[::-1])[::-1]
+    else:
+        idx = np.where(sources, idx, 0)
+        idx = np.maximum.accumulate(idx)
+    return values[idx]
+
+
+def detectScripts(codepoints, offsets):
+    """detectScript for many strings at once. codepoints are the strings'
+    codepoints end to end and a string's codepoints are
+    codepoints[offsets[i]:offsets[i + 1]]."""
+    codepoints = np.asarray(codepoints, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    count = len(codepoints)
+    if not count:
+        return np.zeros(0, dtype=np.int16)
+    script_table, category_table, _ = _unicodeTables()
+    scripts = script_table[codepoints].astype(np.int16)
+    categories = category_table[codepoints]
+    firsts = np.zeros(count, dtype=bool)
+    firsts[offsets[:-1][offsets[:-1] < count]] = True
+    lasts = np.zeros(count, dtype=bool)
+    lasts[offsets[1:][offsets[1:] > offsets[:-1]] - 1] = True
+
+    # Non-spacing marks (Mn) and unknowns inherit the script before them,
+    # except closing brackets which are left unknown
+    inherit = np.isin(scripts, [SCRIPTS.index(s) for s in UNKNOWN_SCRIPT])
+    inherit |= categories == CATEGORIES.index("Mn")
+    mirrored = np.isin(codepoints, [ord(c) for c in MIRRORED])
+    closing = inherit & mirrored & (categories == CATEGORIES.index("Pe"))
+    scripts = np.where(inherit, -1, scripts)
+    scripts = _fill(scripts, ~inherit | closing | firsts)
+    # Any unknowns should be mapped to the _next_ script
+    scripts = _fill(scripts, (scripts != -1) | lasts, reverse=True)
+    # There may be unknowns at the end of the string, fall back to
+    # preceding script
+    scripts = np.where(firsts & (scripts == -1), SCRIPTS.index("Zxxx"), scripts)
+    return _fill(scripts, (scripts != -1) | firsts)
+
+
+def segmentArrays(codepoints, offsets):
+    """textSegments for many strings at once, as arrays. Strings are given
+    the same way as detectScripts.
+
+    Returns the offsets of each string's segments, then the start (within
+    its string), bidi level and script (an index into SCRIPTS) of each
+    segment. Right to left strings are segmented one at a time."""
+    codepoints = np.asarray(codepoints, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    count = len(offsets) - 1
+    _, _, rtl_table = _unicodeTables()
+    rtl = np.concatenate(([0], np.cumsum(rtl_table[codepoints])))
+    rtl_strings = np.nonzero(rtl[offsets[1:]] > rtl[offsets[:-1]])[0]
+
+    # Left to right strings are at level 0 so a new segment starts at each
+    # string's start and wherever the script changes
+    scripts = detectScripts(codepoints, offsets)
+    keys = SCRIPT_KEYS[scripts]
+    starts = np.ones(len(codepoints), dtype=bool)
+    starts[1:] = keys[1:] != keys[:-1]
+    string_ids = np.repeat(np.arange(count), np.diff(offsets))
+    starts[offsets[:-1][offsets[:-1] < len(codepoints)]] = True
+    ltr = np.ones(count, dtype=bool)
+    ltr[rtl_strings] = False
+    positions = np.nonzero(starts & ltr[string_ids])[0]
+    seg_strings = [string_ids[positions]]
+    seg_starts = [positions - offsets[string_ids[positions]]]
+    seg_levels = [np.zeros(len(positions), dtype=np.int64)]
+    seg_scripts = [scripts[positions].astype(np.int64)]
+
+    for i in rtl_strings:
+        txt = "".join(map(chr, codepoints[offsets[i] : offsets[i + 1]]))
+        segments = _bidiTextSegments(txt)[0]
+        seg_strings.append(np.full(len(segments), i))
+        seg_starts.append(np.array([s[3] for s in segments], dtype=np.int64))
+        seg_levels.append(np.array([s[2] for s in segments], dtype=np.int64))
+        seg_scripts.append(np.array([SCRIPTS.index(s[1]) for s in segments], dtype=np.int64))
+
+    seg_strings = np.concatenate(seg_strings)
+    # segments are ordered by string then by their start
+    order = np.lexsort((np.concatenate(seg_starts), seg_strings))
+    seg_offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(seg_strings, minlength=count), out=seg_offsets[1:])
+    return (
+        seg_offsets,
+        np.concatenate(seg_starts)[order],
+        np.concatenate(seg_levels)[order],
+        np.concatenate(seg_scripts)[order],
+    )
+
+
 # copied from bidi/algorthm.py and modified to be more useful for us.
 
 def getBiDiInfo(text, *, upper_is_rtl=False, base_dir=None, debug=False):
@@ -2,17 +2,21 @@
 Check fonts for shaping regressions using real words.
 """
 from __future__ import annotations
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import uharfbuzz as hb
 import os
 from diffenator2 import THRESHOLD
-from diffenator2.renderer import FONT_SIZE, PixelDiffer
+from diffenator2.renderer import FONT_SIZE, PixelDiffer, same_drawing
 from diffenator2.template_elements import Word, WordDiff, Glyph, GlyphDiff
 from diffenator2.utils import gen_gif, resource_filename
 import tqdm
-from diffenator2.segmenting import textSegments
-from collections import defaultdict
-import csv
+import unicodedata2
+# parse_wordlist lived here before wordlist.py, keep it importable
+from diffenator2.wordlist import Wordlist, parse_wordlist
+from diffenator2.cache import flush_caches
+from diffenator2.layout import Layout, LayoutDiff, substitution_sources
+from collections import defaultdict, Counter
+from concurrent.futures import ProcessPoolExecutor
 
 
 # Hashing strategies for elements of a Harfbuzz buffer
@@ -39,51 +43,207 @@ ot_to_html_lang = {
 
 ot_to_dir = {None: "ltr", "arab": "rlt", "hebr": "rtl"}
 
+# Tables, besides the glyphs, GSUB and GPOS, whose changes may affect how
+# any text is shaped
+SHAPING_TABLES = ("GDEF", "kern", "morx", "mort", "kerx", "trak", "HVAR", "avar")
+
+# Each check that may reject an item before it's rendered, in the order
+# they're made. Items which get through all of them are rendered and
+# compared against the threshold.
+GLYPH_STAGES = (
+    "same outlines",
+    "cached results",
+    "same drawings",
+    "below threshold",
+    "above threshold",
+)
+WORD_STAGES = (
+    "unshapeable words",
+    "notdef segments",
+    "same glyph runs",
+    "seen glyphs",
+    "cached results",
+    "same drawings",
+    "below threshold",
+    "above threshold",
+)
+
+
+def _stage_counts(counts, stages):
+    return {stage: counts[stage] for stage in stages}
+
 
 @dataclass
 class GlyphItems:
     missing: list
     new: list
     modified: list
+    # number of glyphs rejected at each of the GLYPH_STAGES
+    stages: dict = field(default_factory=dict)
 
 
-def test_fonts(font_a, font_b, threshold=THRESHOLD, do_words=True, font_size=FONT_SIZE, debug_gifs=False):
-    glyphs = test_font_glyphs(font_a, font_b, threshold=threshold, font_size=font_size)
+def test_fonts(font_a, font_b, threshold=THRESHOLD, do_words=True, font_size=FONT_SIZE, debug_gifs=False, renderer=None, jobs=1, word_characters=None):
+    glyphs = test_font_glyphs(font_a, font_b, threshold=threshold, font_size=font_size, renderer=renderer, jobs=jobs)
     skip_glyphs = glyphs.missing + glyphs.new
+    stages = {"glyphs": glyphs.stages}
     if do_words:
+        word_stages = {}
         words = test_font_words(
-            font_a, font_b, skip_glyphs, threshold=threshold, font_size=font_size, debug_gifs=debug_gifs
+            font_a, font_b, skip_glyphs, threshold=threshold, font_size=font_size, debug_gifs=debug_gifs, renderer=renderer, jobs=jobs, characters=word_characters, stages=word_stages
         )
+        stages.update((f"{script} words", s) for script, s in word_stages.items())
     else:
         words = {}
-    return {"glyphs": glyphs, "words": words}
+    return {"glyphs": glyphs, "words": words, "stages": stages}
 
 
-def test_font_glyphs(font_a, font_b, threshold=THRESHOLD, font_size=FONT_SIZE):
+def test_font_glyphs(font_a, font_b, threshold=THRESHOLD, font_size=FONT_SIZE, renderer=None, jobs=1):
     cmap_a = set(chr(c) for c in font_a.ttFont.getBestCmap())
     cmap_b = set(chr(c) for c in font_b.ttFont.getBestCmap())
     missing_glyphs = set(Glyph(c) for c in cmap_a - cmap_b)
     new_glyphs = set(Glyph(c) for c in cmap_b - cmap_a)
-    same_glyphs = cmap_a & cmap_b
-    skip_glyphs = missing_glyphs | new_glyphs
-    modified_glyphs = []
-    differ = PixelDiffer(font_a, font_b, font_size=font_size)
-    for g in tqdm.tqdm(same_glyphs):
-        pc, diff_map = differ.diff(g)
-        if pc > threshold:
-            glyph = GlyphDiff(g, "%.2f" % pc, diff_map)
-            modified_glyphs.append(glyph)
-    modified_glyphs.sort(key=lambda k: k.changed_pixels, reverse=True)
+    same_glyphs = sorted(cmap_a & cmap_b)
+    stages = Counter()
+    # Color glyphs are drawn from the COLR/SVG tables so their outlines
+    # don't tell us whether they've changed.
+    if not (font_a.is_color() or font_b.is_color()):
+        glyph_names_a = font_a.ttFont.getBestCmap()
+        glyph_names_b = font_b.ttFont.getBestCmap()
+        same_glyphs = [
+            g for g in same_glyphs
+            if font_a.glyph_hash(glyph_names_a[ord(g)]) != \
+                font_b.glyph_hash(glyph_names_b[ord(g)])
+        ]
+        stages["same outlines"] = len(cmap_a & cmap_b) - len(same_glyphs)
+
+    if jobs > 1 and len(same_glyphs) > jobs:
+        # Shard the glyphs so each worker renders a similar mix of them
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(font_a, font_b, font_size, renderer),
+        ) as executor:
+            futures = [
+                executor.submit(_diff_glyph_chunk, same_glyphs[i::jobs], threshold)
+                for i in range(jobs)
+            ]
+            res = []
+            for future in tqdm.tqdm(futures):
+                chunk_res, chunk_stages = future.result()
+                res.extend(chunk_res)
+                stages.update(chunk_stages)
+    else:
+        differ = PixelDiffer(font_a, font_b, font_size=font_size, renderer=renderer)
+        res, glyph_stages = _diff_glyphs(differ, tqdm.tqdm(same_glyphs), threshold)
+        stages.update(glyph_stages)
+
+    modified_glyphs = [
+        GlyphDiff(g, "%.2f" % pc, box)
+        for g, pc, box in sorted(res, key=lambda k: (-k[1], k[0]))
+    ]
 
     return GlyphItems(
         list(sorted(missing_glyphs, key=lambda k: k.string)),
         list(sorted(new_glyphs, key=lambda k: k.string)),
         modified_glyphs,
+        _stage_counts(stages, GLYPH_STAGES),
     )
 
 
+# Characters HarfBuzz can shape without a cmap entry. U+2011 falls back to
+# U+2010 and the rest are default ignorables which aren't format characters
+SHAPE_FALLBACKS = {0x115F, 0x1160, 0x2011, 0x2065, 0x3164, 0xFFA0}
+SHAPE_FALLBACK_CATEGORIES = {"Mn", "Mc", "Me", "Zs", "Zl", "Zp", "Cf", "Cc"}
+
+
+def unshapeable(codepoints, cmap):
+    """The codepoints which can only be shaped as .notdef using cmap.
+
+    Spaces, default ignorables and codepoints which HarfBuzz may compose,
+    decompose or mirror into other codepoints are kept"""
+    if cmap is None:
+        return set()
+    res = set()
+    for u in codepoints:
+        if u in cmap or u in SHAPE_FALLBACKS:
+            continue
+        c = chr(u)
+        decomposition = unicodedata2.decomposition(c)
+        if (
+            unicodedata2.category(c) in SHAPE_FALLBACK_CATEGORIES
+            or unicodedata2.mirrored(c)
+            or (decomposition and not decomposition.startswith("<"))
+            or 0xE0000 <= u <= 0xE0FFF
+            or 0xFFF0 <= u <= 0xFFF8
+        ):
+            continue
+        res.add(u)
+    return res
+
+
+def changed_characters(font_a, font_b, layout=None):
+    """Characters which may shape or render differently in each font, or
+    None if any text may have changed.
+
+    A character has changed if its glyph, or a glyph GSUB may substitute it
+    with, has a different outline or is in a GSUB or GPOS record which has
+    changed. layout is the fonts' LayoutDiff if it has already been made."""
+    # Color glyphs aren't drawn from their outlines so we can't tell
+    if font_a.is_color() or font_b.is_color():
+        return None
+    ttFont_a, ttFont_b = font_a.ttFont, font_b.ttFont
+    if font_a._normalized_location() != font_b._normalized_location():
+        return None
+    same_order = ttFont_a.getGlyphOrder() == ttFont_b.getGlyphOrder()
+    for tag in SHAPING_TABLES:
+        if tag not in ttFont_a and tag not in ttFont_b:
+            continue
+        if tag not in ttFont_a or tag not in ttFont_b:
+            return None
+        # glyph ids are only comparable if the glyph orders match
+        if same_order:
+            if ttFont_a.getTableData(tag) != ttFont_b.getTableData(tag):
+                return None
+        elif ttFont_a[tag] != ttFont_b[tag]:
+            return None
+    # Lookup flags decide which glyphs a lookup skips over, so they change
+    # how text with glyphs outside of the lookup's records is shaped
+    for tag in ("GSUB", "GPOS"):
+        if Layout(ttFont_a, tag).lookup_flags() != Layout(ttFont_b, tag).lookup_flags():
+            return None
+
+    if layout is None:
+        layout = LayoutDiff(ttFont_a, ttFont_b)
+    glyphs_a = set(ttFont_a.getGlyphOrder())
+    glyphs_b = set(ttFont_b.getGlyphOrder())
+    changed = set(layout.changed_glyphs) | (glyphs_a ^ glyphs_b)
+    changed |= {
+        g for g in glyphs_a & glyphs_b if font_a.glyph_hash(g) != font_b.glyph_hash(g)
+    }
+
+    # Walk GSUB backwards to the glyphs which may be substituted with a
+    # changed glyph
+    sources = substitution_sources(ttFont_a)
+    for glyph, inputs in substitution_sources(ttFont_b).items():
+        sources.setdefault(glyph, set()).update(inputs)
+    todo = list(changed)
+    while todo:
+        for glyph in sources.get(todo.pop(), ()):
+            if glyph not in changed:
+                changed.add(glyph)
+                todo.append(glyph)
+
+    cmap_a = ttFont_a.getBestCmap()
+    cmap_b = ttFont_b.getBestCmap()
+    return {
+        chr(u)
+        for u in cmap_a.keys() | cmap_b.keys()
+        if cmap_a.get(u) != cmap_b.get(u) or cmap_a[u] in changed
+    }
+
+
 def test_font_words(
-    font_a, font_b, skip_glyphs=set(), threshold=THRESHOLD, font_size=FONT_SIZE, debug_gifs=False
+    font_a, font_b, skip_glyphs=set(), threshold=THRESHOLD, font_size=FONT_SIZE, debug_gifs=False, renderer=None, jobs=1, characters=None, stages=None
 ):
     from youseedee import ucd_data
     from collections import defaultdict
@@ -113,36 +273,31 @@ def test_font_words(
             threshold=threshold,
             font_size=font_size,
             debug_gifs=debug_gifs,
+            renderer=renderer,
+            jobs=jobs,
+            characters=characters,
+            stages=None if stages is None else stages.setdefault(script, {}),
         )
     return res
 
 
-def parse_wordlist(fp):
-    from diffenator2.shape import Word as TemplateWord
-
-    results = []
-    with open(fp, encoding="utf8") as doc:
-        lines = doc.read().split("\n")
-        parsed = csv.reader(lines)
-        for items in parsed:
-            if len(items) == 0:
-                continue
-            try:
-                results.append(
-                    TemplateWord(
-                        string=items[0],
-                        script=items[1],
-                        lang=items[2],
-                        ot_features={k: True for k in items[3:]},
-                    )
-                )
-            except IndexError:
-                results.append(
-                    TemplateWord(
-                        string=items[0], script=None, lang=None, ot_features={}
-                    )
-                )
-    return results
+def same_glyph_run(font_a, buf_a, font_b, buf_b):
+    """Check whether two shaped buffers place glyphs with the same outlines
+    at the same positions."""
+    infos_a, infos_b = buf_a.glyph_infos, buf_b.glyph_infos
+    if len(infos_a) != len(infos_b):
+        return False
+    for pos_a, pos_b in zip(buf_a.glyph_positions, buf_b.glyph_positions):
+        if pos_a.position != pos_b.position:
+            return False
+    glyph_order_a = font_a.ttFont.getGlyphOrder()
+    glyph_order_b = font_b.ttFont.getGlyphOrder()
+    for info_a, info_b in zip(infos_a, infos_b):
+        hash_a = font_a.glyph_hash(glyph_order_a[info_a.codepoint])
+        hash_b = font_b.glyph_hash(glyph_order_b[info_b.codepoint])
+        if hash_a != hash_b:
+            return False
+    return True
 
 
 def test_words(
@@ -154,78 +309,235 @@ def test_words(
     threshold=THRESHOLD,
     font_size=FONT_SIZE,
     debug_gifs=False,
+    renderer=None,
+    jobs=1,
+    characters=None,
+    stages=None,
 ):
-    res = set()
+    """Diff the words in a wordlist. If characters is given, only words
+    which contain one of them are diffed. If stages is a dict, it's updated
+    with the number of words or segments rejected at each of the
+    WORD_STAGES."""
+    word_list = Wordlist(word_file)
+    if characters is not None:
+        word_list = word_list.select(characters)
+    # Leave out segments which use a skipped glyph or which either font can
+    # only shape with .notdef before shaping anything
+    codepoints = [int(u) for u in word_list.codepoints()]
+    skip = {ord(g.string) for g in skip_glyphs}
+    skip |= unshapeable(codepoints, font_a.ttFont.getBestCmap())
+    skip |= unshapeable(codepoints, font_b.ttFont.getBestCmap())
+    counts = Counter()
+    counts["unshapeable words"] = len(word_list)
+    word_list = word_list.without(skip)
+    counts["unshapeable words"] -= len(word_list)
+    options = dict(
+        hash_func=hash_func,
+        threshold=threshold,
+        debug_gifs=debug_gifs,
+    )
+    if jobs > 1 and len(word_list) > jobs:
+        # Each worker diffs a contiguous chunk of the wordlist so the
+        # results don't depend on how the work was scheduled.
+        chunks = [
+            (start, word_list[start : start + len(word_list) // jobs + 1])
+            for start in range(0, len(word_list), len(word_list) // jobs + 1)
+        ]
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(font_a, font_b, font_size, renderer),
+        ) as executor:
+            futures = [
+                executor.submit(_diff_word_chunk, start, chunk, options)
+                for start, chunk in chunks
+            ]
+            res = []
+            for future in tqdm.tqdm(futures):
+                chunk_res, chunk_counts = future.result()
+                res.extend(chunk_res)
+                counts.update(chunk_counts)
+    else:
+        differ = PixelDiffer(font_a, font_b, font_size=font_size, renderer=renderer)
+        res, word_counts = _diff_words(
+            differ, 0, tqdm.tqdm(word_list.items(), total=len(word_list)), **options
+        )
+        counts.update(word_counts)
+
+    # Chunks are diffed independently so apply the seen glyphs check across
+    # them in wordlist order. Segments below the threshold mark their glyphs
+    # as seen too, so this gives the same words as a single chunk.
+    seen_gids = set()
+    merged = []
+    for pc, i, word_diff, gid_hashes, stage in sorted(res, key=lambda k: k[1]):
+        if all(gid_hash in seen_gids for gid_hash in gid_hashes):
+            counts[stage] -= 1
+            counts["seen glyphs"] += 1
+            continue
+        seen_gids.update(gid_hashes)
+        if word_diff is not None:
+            merged.append((pc, i, word_diff))
+    if stages is not None:
+        stages.update(_stage_counts(counts, WORD_STAGES))
+
+    # Words are ordered by how much they changed, then by their position in
+    # the wordlist. Identical diffs are only reported once.
+    seen = set()
+    words = []
+    for _, _, word_diff in sorted(merged, key=lambda k: (-k[0], k[1])):
+        if word_diff in seen:
+            continue
+        seen.add(word_diff)
+        words.append(word_diff)
+    return words
+
+
+# PixelDiffer used by process pool workers. Each worker loads its fonts once.
+_worker_differ = None
+
+
+def _init_worker(font_a, font_b, font_size, renderer):
+    global _worker_differ
+    _worker_differ = PixelDiffer(font_a, font_b, font_size=font_size, renderer=renderer)
+
+
+def _diff_word_chunk(start, word_list, options):
+    res = _diff_words(_worker_differ, start, word_list.items(), **options)
+    flush_caches()
+    return res
+
+
+def _diff_glyph_chunk(glyphs, threshold):
+    res = _diff_glyphs(_worker_differ, glyphs, threshold)
+    flush_caches()
+    return res
+
+
+def _diff_run(differ, string, buf_a, buf_b):
+    """Diff a string which each font has shaped. Returns (changed pixels,
+    changed box, stage). stage is the check which settled the result
+    without comparing pixels, or None if they were compared."""
+    # Results are cached by what's drawn, so a run whose glyphs haven't
+    # changed since a previous diff isn't drawn again
+    key = differ.result_key(buf_a, buf_b)
+    result = differ.cached_result(key)
+    if result is not None:
+        return (*result, "cached results")
+    # Only paint and compare the pixels of strings which are laid out
+    # differently
+    drawings = differ.draw(string)
+    if same_drawing(*drawings):
+        pc, box, stage = 0, None, "same drawings"
+    else:
+        (pc, box), stage = differ.diff(string, drawings), None
+    differ.store_result(key, (pc, box))
+    return pc, box, stage
+
+
+def _diff_glyphs(differ, glyphs, threshold):
+    """Diff single characters. Returns (character, changed pixels, changed
+    box) for each character which exceeds the threshold and the number of
+    characters rejected at each stage."""
+    res = []
+    stages = Counter()
+    for g in glyphs:
+        pc, box, stage = _diff_run(differ, g, *differ.shape(g))
+        if stage is None:
+            stage = "above threshold" if pc > threshold else "below threshold"
+        stages[stage] += 1
+        if pc > threshold:
+            res.append((g, pc, box))
+    return res, stages
+
+
+def _diff_words(
+    differ,
+    start,
+    items,
+    hash_func=gid_pos_hash,
+    threshold=THRESHOLD,
+    debug_gifs=False,
+):
+    """Diff (word, segments) items. Returns (changed pixels, word index, WordDiff,
+    glyph hashes, stage) for each segment whose pixels were diffed and the
+    number of segments rejected at each stage. WordDiff is None for
+    segments below the threshold."""
+    res = []
+    stages = Counter()
 
     seen_gids = defaultdict(int)
 
-    differ = PixelDiffer(font_a, font_b, font_size=font_size)
-    word_list = parse_wordlist(word_file)
-    for i, word in tqdm.tqdm(enumerate(word_list), total=len(word_list)):
+    font_a, font_b = differ.font_a, differ.font_b
+    compare_outlines = not (font_a.is_color() or font_b.is_color())
+    for i, (word, segments) in enumerate(items, start):
         differ.set_script(word.script)
         differ.set_lang(word.lang)
         differ.set_features(word.ot_features)
 
-        # split sentences into individual script segments. This mimmics the
-        # same behaviour as dtp apps, web browsers etc
-        for (
-            segment,
-            script,
-            _,
-            _,
-        ) in textSegments(
-            word.string
-        )[0]:
-            if any(c.string in segment for c in skip_glyphs):
-                continue
-
+        # sentences are split into individual script segments. This mimmics
+        # the same behaviour as dtp apps, web browsers etc
+        for segment, script, _, _ in segments:
             if not segment:
                 continue
 
             buf_b = differ.renderer_b.shape(segment)
             word_b = Word.from_buffer(segment, buf_b)
-
-            gid_hashes = [
-                hash_func(i, j)
-                for i, j in zip(buf_b.glyph_infos, buf_b.glyph_positions)
-            ]
-            # I'm not entirely convinced this is a valid test; but it seems to
-            # work and speeds things up a lot...
-            if all(gid_hash in seen_gids for gid_hash in gid_hashes):
-                continue
-
             buf_a = differ.renderer_a.shape(segment)
             word_a = Word.from_buffer(segment, buf_a)
 
             # skip any words which cannot be shaped correctly
             if any([g.codepoint == 0 for g in buf_a.glyph_infos + buf_b.glyph_infos]):
+                stages["notdef segments"] += 1
                 continue
 
-            pc, diff_map = differ.diff(segment)
+            # identical glyphs at identical positions will render identically
+            if compare_outlines and same_glyph_run(font_a, buf_a, font_b, buf_b):
+                stages["same glyph runs"] += 1
+                continue
+
+            gid_hashes = [
+                hash_func(info, pos)
+                for info, pos in zip(buf_b.glyph_infos, buf_b.glyph_positions)
+            ]
+            # Only report the first word which contains a given positioned
+            # glyph. Without this, a single modified glyph would flood the
+            # report with every word that uses it.
+            if all(gid_hash in seen_gids for gid_hash in gid_hashes):
+                stages["seen glyphs"] += 1
+                continue
+
+            pc, _, stage = _diff_run(differ, segment, buf_a, buf_b)
+            if stage is None:
+                stage = "below threshold" if pc < threshold else "above threshold"
+            stages[stage] += 1
 
             for gid_hash in gid_hashes:
                 seen_gids[gid_hash] = True
 
-                if pc < threshold:
-                    continue
-                if debug_gifs:
-                    out_fp = "debug_gifs"
-                    if not os.path.exists("debug_gifs"):
-                        os.makedirs("debug_gifs")
-                    fp = os.path.join(out_fp, f"{pc:.2f}_{word.string}.gif".replace("/", "_"))
-                    differ.debug_gif(fp)
-                res.add(
-                    (
-                        pc,
-                        WordDiff(
-                            word.string,
-                            word_a.hb,
-                            word_b.hb,
-                            tuple(word.ot_features.keys()),
-                            ot_to_html_lang.get((script, word.lang)),
-                            ot_to_dir.get(script, None),
-                            "%.2f" % pc,
-                        ),
-                    )
+            if pc < threshold:
+                res.append((pc, i, None, gid_hashes, stage))
+                continue
+            if debug_gifs:
+                out_fp = "debug_gifs"
+                if not os.path.exists("debug_gifs"):
+                    os.makedirs("debug_gifs", exist_ok=True)
+                fp = os.path.join(out_fp, f"{pc:.2f}_{word.string}.gif".replace("/", "_"))
+                differ.debug_gif(fp)
+            res.append(
+                (
+                    pc,
+                    i,
+                    WordDiff(
+                        word.string,
+                        word_a.hb,
+                        word_b.hb,
+                        tuple(word.ot_features.keys()),
+                        ot_to_html_lang.get((script, word.lang)),
+                        ot_to_dir.get(script, None),
+                        "%.2f" % pc,
+                    ),
+                    gid_hashes,
+                    stage,
                 )
-    return [w[1] for w in sorted(res, key=lambda k: k[0], reverse=True)]
+            )
+    return res, stages
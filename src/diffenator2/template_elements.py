@@ -80,7 +80,8 @@ class Glyph(Renderable):
 class GlyphDiff(Renderable):
     string: str
     changed_pixels: str
-    diff_map: list[int]
+    # (left, top, right, bottom) pixels which changed, see PixelDiffer.diff
+    changed_box: tuple[int, int, int, int] = None
     name: str=None
     unicode: str=None
 
@@ -27,6 +27,7 @@ from fontTools.ttLib import TTFont
 from zipfile import ZipFile
 import re
 import json
+import hashlib
 from glyphsets import get_glyphsets_fulfilled
 
 
@@ -202,6 +203,41 @@ def font_family_name(ttFont, suffix=""):
         return familyname
 
 
+@lru_cache(maxsize=None)
+def file_sha256(fp: str, mtime: float = None) -> str:
+    """sha256 of a file's contents. Pass the file's mtime so edited files
+    aren't served from the cache."""
+    h = hashlib.sha256()
+    with open(fp, "rb") as doc:
+        for chunk in iter(lambda: doc.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def content_hash(obj, files=()) -> str:
+    """sha256 of an object's repr plus the contents of some files"""
+    h = hashlib.sha256(repr(obj).encode("utf8"))
+    for fp in files:
+        h.update(file_sha256(fp, os.path.getmtime(fp)).encode("utf8"))
+    return h.hexdigest()
+
+
+def write_stamp(fp: str, reports=()):
+    """Mark a ninja build edge as done. The stamp lists the reports the
+    edge wrote, see stamp_is_valid."""
+    os.makedirs(os.path.dirname(fp), exist_ok=True)
+    with open(fp, "w", encoding="utf8") as doc:
+        doc.write("".join(f"{os.path.abspath(f)}\n" for f in reports))
+
+
+def stamp_is_valid(fp: str) -> bool:
+    """A stamp is only valid while every report it lists still exists"""
+    if not os.path.exists(fp):
+        return False
+    with open(fp, encoding="utf8") as doc:
+        return all(os.path.exists(f) for f in doc.read().splitlines())
+
+
 def partition(items, size):
     """partition([1,2,3,4,5,6], 2) --> [[1,2],[3,4],[5,6]]"""
     return [items[i : i + size] for i in range(0, len(items), size)]
@@ -0,0 +1,281 @@
+"""
+Load wordlists as arrays of codepoints.
+
+Wordlists are csv text files. Parsing and segmenting them takes longer
+than diffing many of their words, so scripts/build_wordlist_index.py
+compiles the packaged wordlists into binary indexes which are memory
+mapped. An index stores each word's codepoints (UTF-16 if they're all in
+the BMP, otherwise UTF-32), its script segments and their bidi levels.
+Wordlists without an up to date index are parsed and segmented when
+they're loaded.
+
+Index layout: b"DFWL", a little endian uint32 header length, a json
+header then the arrays listed in the header, each 8 byte aligned.
+"""
+from __future__ import annotations
+from diffenator2.template_elements import Word
+from diffenator2.segmenting import SCRIPTS, segmentArrays
+from diffenator2.utils import file_sha256
+from functools import lru_cache
+import unicodedata2
+import numpy as np
+import struct
+import mmap
+import json
+import csv
+import os
+
+
+MAGIC = b"DFWL"
+VERSION = 1
+
+
+def parse_wordlist(fp):
+    results = []
+    with open(fp, encoding="utf8") as doc:
+        lines = doc.read().split("\n")
+        parsed = csv.reader(lines)
+        for items in parsed:
+            if len(items) == 0:
+                continue
+            try:
+                results.append(
+                    Word(
+                        string=items[0],
+                        script=items[1],
+                        lang=items[2],
+                        ot_features={k: True for k in items[3:]},
+                    )
+                )
+            except IndexError:
+                results.append(
+                    Word(string=items[0], script=None, lang=None, ot_features={})
+                )
+    return results
+
+
+def index_path(fp):
+    return os.path.splitext(fp)[0] + ".idx"
+
+
+def _source_key(fp):
+    # An index is stale if its wordlist or the unicode data used to
+    # segment it have changed
+    return {
+        "version": VERSION,
+        "source": file_sha256(fp, os.path.getmtime(fp)),
+        "unicode": unicodedata2.unidata_version,
+    }
+
+
+def _uint(values, dtypes=("u1", "<u2", "<u4")):
+    """values as the smallest unsigned int array which fits them"""
+    values = np.asarray(values)
+    top = int(values.max()) if len(values) else 0
+    dtype = next(d for d in dtypes if top <= np.iinfo(d).max)
+    return values.astype(dtype)
+
+
+def _decode(chars):
+    return chars.tobytes().decode("utf-16-le" if chars.itemsize == 2 else "utf-32-le")
+
+
+def _word_arrays(words):
+    """Arrays of the words' codepoints, features and segments"""
+    strings = [w.string for w in words]
+    lengths = np.array([len(s) for s in strings], dtype="<u4")
+    offsets = np.zeros(len(strings) + 1, dtype="<u4")
+    np.cumsum(lengths, out=offsets[1:])
+    chars = np.frombuffer("".join(strings).encode("utf-32-le"), dtype="<u4")
+    seg_offsets, seg_starts, seg_levels, seg_scripts = segmentArrays(chars, offsets)
+    metas = {}
+    meta_ids = _uint(
+        [
+            metas.setdefault((w.script, w.lang, tuple(w.ot_features)), len(metas))
+            for w in words
+        ]
+    )
+    arrays = {
+        # The codepoints of BMP only text are its UTF-16 code units
+        "chars": _uint(chars, ("<u2", "<u4")),
+        "offsets": offsets,
+        "meta_ids": meta_ids,
+        "seg_offsets": seg_offsets.astype("<u4"),
+        "seg_starts": _uint(seg_starts),
+        "seg_levels": seg_levels.astype("u1"),
+        "seg_scripts": _uint(seg_scripts),
+    }
+    return arrays, list(metas)
+
+
+def compile_wordlist(fp, dst=None):
+    """Compile a wordlist into a binary index, next to it by default"""
+    arrays, metas = _word_arrays(parse_wordlist(fp))
+    header = {**_source_key(fp), "metas": metas, "scripts": SCRIPTS}
+    header["arrays"] = layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        layout[name] = [arr.dtype.str, offset, len(arr)]
+        offset += -(-arr.nbytes // 8) * 8
+    header = json.dumps(header).encode("utf8")
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)
+
+    with open(dst or index_path(fp), "wb") as doc:
+        doc.write(MAGIC + struct.pack("<I", len(header)) + header)
+        for arr in arrays.values():
+            doc.write(arr.tobytes())
+            doc.write(b"\0" * (-arr.nbytes % 8))
+
+
+def _read_index(fp, source):
+    with open(fp, "rb") as doc:
+        if doc.read(len(MAGIC)) != MAGIC:
+            return None
+        size = struct.unpack("<I", doc.read(4))[0]
+        header = json.loads(doc.read(size))
+        if any(header.get(k) != v for k, v in _source_key(source).items()):
+            return None
+        data = mmap.mmap(doc.fileno(), 0, access=mmap.ACCESS_READ)
+    start = len(MAGIC) + 4 + size
+    arrays = {
+        name: np.frombuffer(data, dtype=dtype, count=count, offset=start + offset)
+        for name, (dtype, offset, count) in header["arrays"].items()
+    }
+    return arrays, [tuple(m) for m in header["metas"]], header["scripts"]
+
+
+@lru_cache(maxsize=None)
+def _load(fp, mtime):
+    idx = index_path(fp)
+    if os.path.exists(idx):
+        res = _read_index(idx, fp)
+        if res is not None:
+            return res
+    arrays, metas = _word_arrays(parse_wordlist(fp))
+    return arrays, metas, SCRIPTS
+
+
+class Wordlist:
+    def __init__(self, fp, ids=None, skip=None):
+        """The words in a wordlist file. Slicing or selecting words returns
+        a view of the same wordlist. skip is a sorted array of codepoints,
+        segments which contain them are left out.
+
+        Each process loads a wordlist once. Views pickle as the wordlist's
+        path, word ids and skipped codepoints so they're cheap to send to
+        worker processes."""
+        self.fp = fp
+        self._arrays, self._metas, self._scripts = _load(fp, os.path.getmtime(fp))
+        if ids is None:
+            ids = np.arange(len(self._arrays["meta_ids"]))
+        self.ids = ids
+        self.skip = skip
+        self._segments_ok = None
+        if skip is not None:
+            self._segments_ok = self._segments_without(skip)
+
+    def __reduce__(self):
+        return Wordlist, (self.fp, self.ids, self.skip)
+
+    def _view(self, ids):
+        view = object.__new__(Wordlist)
+        view.__dict__.update(self.__dict__, ids=ids)
+        return view
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self._view(self.ids[i])
+        return self.word(self.ids[i])
+
+    def __iter__(self):
+        for word_id in self.ids:
+            yield self.word(word_id)
+
+    def string(self, word_id):
+        offsets = self._arrays["offsets"]
+        chars = self._arrays["chars"][offsets[word_id] : offsets[word_id + 1]]
+        return _decode(chars)
+
+    def word(self, word_id):
+        script, lang, features = self._metas[self._arrays["meta_ids"][word_id]]
+        return Word(
+            string=self.string(word_id),
+            script=script,
+            lang=lang,
+            ot_features={k: True for k in features},
+        )
+
+    def segments(self, word_id):
+        """The same segments as segmenting.textSegments, less any which
+        contain a skipped codepoint"""
+        string = self.string(word_id)
+        arrays = self._arrays
+        start, end = arrays["seg_offsets"][word_id : word_id + 2]
+        starts = [int(i) for i in arrays["seg_starts"][start:end]] + [len(string)]
+        return [
+            (
+                string[starts[i] : starts[i + 1]],
+                self._scripts[arrays["seg_scripts"][start + i]],
+                int(arrays["seg_levels"][start + i]),
+                starts[i],
+            )
+            for i in range(end - start)
+            if self._segments_ok is None or self._segments_ok[start + i]
+        ]
+
+    def items(self):
+        """(word, segments) for each word"""
+        for word_id in self.ids:
+            yield self.word(word_id), self.segments(word_id)
+
+    def codepoints(self):
+        """Sorted array of the codepoints used by the wordlist's words"""
+        return np.unique(self._arrays["chars"])
+
+    def _found(self, codepoints):
+        # Cumulative counts of the characters which are one of the
+        # codepoints. The count for chars[i:j] is found[j] - found[i],
+        # which is safe for empty words, unlike np.add.reduceat.
+        found = np.isin(self._arrays["chars"], codepoints)
+        return np.concatenate(([0], np.cumsum(found)))
+
+    def _segments_without(self, codepoints):
+        """Mask of the segments which don't contain any of the codepoints"""
+        arrays = self._arrays
+        offsets = arrays["offsets"].astype(np.int64)
+        seg_offsets = arrays["seg_offsets"].astype(np.int64)
+        seg_counts = np.diff(seg_offsets)
+        seg_words = np.repeat(np.arange(len(seg_counts)), seg_counts)
+        starts = offsets[seg_words] + arrays["seg_starts"]
+        # a segment ends where the next one starts, or at its word's end
+        ends = np.empty_like(starts)
+        ends[:-1] = starts[1:]
+        has_segments = seg_counts > 0
+        ends[seg_offsets[1:][has_segments] - 1] = offsets[1:][has_segments]
+        found = self._found(codepoints)
+        return found[ends] == found[starts]
+
+    def select(self, characters):
+        """The words which contain any of the characters"""
+        offsets = self._arrays["offsets"]
+        codepoints = np.array(sorted(ord(c) for c in characters), dtype="<u4")
+        found = self._found(codepoints)
+        return self._view(
+            self.ids[found[offsets[self.ids + 1]] > found[offsets[self.ids]]]
+        )
+
+    def without(self, codepoints):
+        """Leave out the segments which contain any of the codepoints, and
+        the words which have no other segments"""
+        skip = np.array(sorted(codepoints), dtype="<u4")
+        if self.skip is not None:
+            skip = np.union1d(self.skip, skip)
+        view = Wordlist(self.fp, self.ids, skip)
+        seg_offsets = self._arrays["seg_offsets"]
+        ok = np.concatenate(([0], np.cumsum(view._segments_ok)))
+        ids = view.ids
+        view.ids = ids[ok[seg_offsets[ids + 1]] > ok[seg_offsets[ids]]]
+        return view
@@ -0,0 +1,91 @@
+import pytest
+import pickle
+import numpy as np
+import freetype
+from . import *
+from diffenator2.cache import DiskCache, CachedDict
+from diffenator2.font import DFont
+from diffenator2.renderer import Renderer
+
+
+def test_disk_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = DiskCache(path)
+    key = cache.key("font", 1)
+    assert cache.get(key) is None
+    cache.put(key, b"tile")
+    assert cache.get(key) == b"tile"
+    cache.close()
+    # entries are shared by every cache which opens the file
+    assert DiskCache(path).get(key) == b"tile"
+    assert pickle.loads(pickle.dumps(cache)).get(key) == b"tile"
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), max_size=1 << 20)
+    keys = [cache.key(i) for i in range(12)]
+    for key in keys[:8]:
+        cache.put(key, bytes(100_000))
+    cache.flush()
+    # reading an entry marks it as recently used
+    assert cache.get(keys[0]) is not None
+    for key in keys[8:]:
+        cache.put(key, bytes(100_000))
+    cache.flush()
+    assert cache.size() <= cache.max_size
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[-1]) is not None
+
+
+def test_cached_dict(tmp_path):
+    disk = DiskCache(str(tmp_path / "cache.sqlite"))
+    cache = CachedDict(disk, "font")
+    cache[("a", 1)] = (np.arange(4, dtype=np.uint8), 1, 2)
+    assert ("a", 1) in cache
+    assert ("b", 1) not in cache
+    # entries are namespaced
+    assert ("a", 1) not in CachedDict(disk, "other font")
+    other = CachedDict(disk, "font")
+    assert ("a", 1) in other
+    pixels, left, top = other[("a", 1)]
+    assert np.array_equal(pixels, np.arange(4)) and (left, top) == (1, 2)
+
+
+@pytest.mark.parametrize("backend", ["freetype", "skia"])
+def test_renderer_disk_cache(tmp_path, monkeypatch, backend):
+    disk = DiskCache(str(tmp_path / "cache.sqlite"))
+    font = DFont(mavenpro_vf)
+    font.set_disk_cache(disk)
+    img, _ = Renderer(font, font_size=28, margin=0, backend=backend).render("an tan")
+    disk.flush()
+
+    # a new process loads the tiles instead of rasterizing them
+    def rasterize(*args, **kwargs):
+        raise AssertionError("glyph was rasterized")
+
+    monkeypatch.setattr("diffenator2.renderer.getSurfaceClass", rasterize)
+    monkeypatch.setattr(freetype.Face, "load_glyph", rasterize)
+    font = pickle.loads(pickle.dumps(font))
+    assert font.disk_cache.path == disk.path
+    cached, _ = Renderer(font, font_size=28, margin=0, backend=backend).render("an tan")
+    assert np.array_equal(np.asarray(img), np.asarray(cached))
+
+
+@pytest.mark.parametrize("backend", ["freetype", "skia"])
+def test_renderer_disk_cache_location(tmp_path, backend):
+    disk = DiskCache(str(tmp_path / "cache.sqlite"))
+    font = DFont(commissioner_vf)
+    font.set_disk_cache(disk)
+    Renderer(font, backend=backend).set_variations({"wght": 900})
+    # the font is still at wght 900, so its tiles aren't the default ones
+    Renderer(font, font_size=28, margin=0, backend=backend).render("an tan")
+    disk.flush()
+
+    font = DFont(commissioner_vf)
+    font.set_disk_cache(disk)
+    img, _ = Renderer(font, font_size=28, margin=0, backend=backend).render("an tan")
+    expected, _ = Renderer(
+        DFont(commissioner_vf), font_size=28, margin=0, backend=backend
+    ).render("an tan")
+    assert np.array_equal(np.asarray(img), np.asarray(expected))
@@ -171,4 +171,39 @@ def test_masters(fp, expected):
     masters = font.masters()
     for got, want in zip(masters, expected):
         assert got.name == want["name"]
-        assert got.coords == want["coords"]
\ No newline at end of file
+        assert got.coords == want["coords"]
+
+@pytest.mark.parametrize(
+    "fp_a, fp_b, coords, expected",
+    [
+        (mavenpro_vf, mavenpro_vf, {"wght": 400}, {"space": True, "a": True, "n": True, "t": True}),
+        (mavenpro_vf, mavenpro_vf_mod, {"wght": 400}, {"space": True, "a": False, "n": True, "t": True}),
+        (mavenpro_vf, mavenpro_vf_mod, {"wght": 900}, {"space": True, "a": False, "n": True, "t": True}),
+    ]
+)
+def test_glyph_hash(fp_a, fp_b, coords, expected):
+    font_a = DFont(fp_a)
+    font_b = DFont(fp_b)
+    font_a.set_variations(coords)
+    font_b.set_variations(coords)
+    for glyph_name, same in expected.items():
+        assert (font_a.glyph_hash(glyph_name) == font_b.glyph_hash(glyph_name)) == same
+
+
+def test_glyph_hash_location():
+    font = DFont(mavenpro_vf)
+    font.set_variations({"wght": 400})
+    regular = font.glyph_hash("a")
+    font.set_variations({"wght": 900})
+    assert font.glyph_hash("a") != regular
+
+
+def test_lazy_engines():
+    font = DFont(mavenpro_vf)
+    font.set_variations({"wght": 900})
+    assert "ftFont" not in font.__dict__
+    assert "blackFont" not in font.__dict__
+    # variations set before the engine existed are applied when it's made
+    assert font.ftFont.get_var_design_coords() == (900,)
+    font.set_variations({"wght": 400})
+    assert font.ftFont.get_var_design_coords() == (400,)
@@ -70,6 +70,27 @@ def test_diffenator(fp_before, fp_after):
         assert any(f.endswith(".html") for f in os.listdir(tmp_dir))
 
 
+@pytest.mark.parametrize(
+    "executor",
+    ["ninja", "inprocess"]
+)
+def test_diffenator_executor(executor):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cmd = [
+            "diffenator2", "diff", "-fb", mavenpro_vf, "-fa", mavenpro_vf_mod,
+            "-o", tmp_dir, "--no-diffbrowsers", "--no-words",
+            "--executor", executor,
+        ]
+        subprocess.run(cmd, check=True)
+        reports = [f for f in os.listdir(tmp_dir) if f.endswith("-diffenator.html")]
+        assert reports
+        # deleted reports are written again by the next run
+        for f in reports:
+            os.remove(os.path.join(tmp_dir, f))
+        subprocess.run(cmd, check=True)
+        assert all(os.path.exists(os.path.join(tmp_dir, f)) for f in reports)
+
+
 @pytest.mark.parametrize(
     "fp_before, fp_after, threshold, has, missing",
     [
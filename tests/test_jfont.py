@@ -0,0 +1,114 @@
+import pytest
+from . import *
+from diffenator2 import jfont
+from diffenator2.font import DFont
+
+
+@pytest.mark.parametrize(
+    "fp_a, fp_b, expected",
+    [
+        (mavenpro_vf, mavenpro_vf, []),
+        (mavenpro_vf, mavenpro_vf_mod, ["head", "hhea", "hmtx", "maxp"]),
+    ]
+)
+def test_changed_tables(fp_a, fp_b, expected):
+    font_a = DFont(fp_a)
+    font_b = DFont(fp_b)
+    assert jfont.changed_tables(font_a.ttFont, font_b.ttFont) == expected
+
+
+def test_changed_tables_decompile_dependencies():
+    from fontTools.ttLib import TTFont
+    font_a = TTFont(mavenpro_vf)
+    font_b = TTFont(mavenpro_vf)
+    # hmtx is decompiled using hhea's numberOfHMetrics
+    font_b["hhea"].ascent += 1
+    assert jfont.changed_tables(font_a, font_b) == ["hhea", "hmtx"]
+    assert jfont.table_dependencies("gvar") == ["fvar", "glyf", "loca"]
+
+
+@pytest.mark.parametrize(
+    "fp_a, fp_b",
+    [
+        (mavenpro_vf, mavenpro_vf_mod),
+        (mavenpro_vf, mavenpro_extra_bold),
+    ]
+)
+def test_changed_tables_diff(fp_a, fp_b):
+    font_a = DFont(fp_a)
+    font_b = DFont(fp_b)
+    tables = jfont.changed_tables(font_a.ttFont, font_b.ttFont)
+    lazy = jfont.Diff(
+        jfont.TTJ(font_a.ttFont, tables), jfont.TTJ(font_b.ttFont, tables)
+    )
+    full = jfont.Diff(jfont.TTJ(font_a.ttFont), jfont.TTJ(font_b.ttFont))
+    assert lazy.diff == full.diff
+
+
+@pytest.mark.parametrize(
+    "obj_a, obj_b, expected",
+    [
+        ({"a": 1}, {"a": 1}, {}),
+        ({"a": 1, "b": 2}, {"a": 1, "b": 3}, {"b": [2, 3]}),
+        ({"a": 1}, {}, {"a": [1, None]}),
+        ({"a": [1, 2]}, {"a": [1]}, {"a": {1: [2, None]}}),
+        ({"a": {"b": 1}}, {"a": 2}, {"a": {"b": [1, 2]}}),
+        (1, 2, [1, 2]),
+        (None, None, False),
+        (
+            {"a": {str(i): i for i in range(200)}},
+            {"a": {str(i): i + 1 for i in range(200)}},
+            {"a": {"error": ("There are 200 changes, check manually!", "")}},
+        ),
+    ]
+)
+def test_diff(obj_a, obj_b, expected):
+    assert jfont.Diff(obj_a, obj_b).diff == expected
+
+
+def test_diff_deep():
+    obj_a, obj_b = 1, 2
+    for _ in range(5000):
+        obj_a, obj_b = {"a": obj_a}, {"a": obj_b}
+    diff = jfont.Diff(obj_a, obj_b).diff
+    for _ in range(5000):
+        diff = diff["a"]
+    assert diff == [1, 2]
+
+
+def test_table_diff():
+    import json
+    import os
+    import tempfile
+    font_a = DFont(mavenpro_vf)
+    font_b = DFont(mavenpro_vf_mod)
+    diff = jfont.TableDiff(font_a.ttFont, font_b.ttFont)
+    full = jfont.Diff(jfont.TTJ(font_a.ttFont), jfont.TTJ(font_b.ttFont)).diff
+    assert set(diff.files) == set(full)
+    with tempfile.TemporaryDirectory() as tmp:
+        diff.save(os.path.join(tmp, "report-tables"))
+        assert '"hmtx": "report-tables/' in diff.render()
+        with open(os.path.join(tmp, "report-tables", diff.files["hmtx"])) as doc:
+            js = doc.read()
+        prefix = 'fontdiffLoaded("hmtx", '
+        assert js.startswith(prefix)
+        assert json.loads(js[len(prefix):-3]) == json.loads(json.dumps(full["hmtx"]))
+
+
+def test_table_diff_cache(tmp_path, monkeypatch):
+    from diffenator2.cache import DiskCache
+    cache = DiskCache(str(tmp_path / "cache.sqlite"))
+    font_a = DFont(mavenpro_vf)
+    font_b = DFont(mavenpro_vf_mod)
+    diff = jfont.TableDiff(font_a.ttFont, font_b.ttFont, cache=cache)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("table was diffed")
+
+    monkeypatch.setattr(jfont, "Diff", fail)
+    cached = jfont.TableDiff(font_a.ttFont, font_b.ttFont, cache=cache)
+    assert cached.files.keys() == diff.files.keys()
+    # a changed table is diffed again
+    font_b.ttFont["head"].fontRevision += 1
+    with pytest.raises(AssertionError):
+        jfont.TableDiff(font_a.ttFont, font_b.ttFont, tables=["head"], cache=cache)
@@ -0,0 +1,160 @@
+import pytest
+from . import *
+from fontTools.ttLib import TTFont
+from diffenator2.layout import Layout, LayoutDiff, substitution_sources
+
+
+def _pair(ttFont, first, second):
+    lookup = ttFont["GPOS"].table.LookupList.Lookup[0]
+    for st in lookup.SubTable:
+        if st.Format == 1 and first in st.Coverage.glyphs:
+            pair_set = st.PairSet[st.Coverage.glyphs.index(first)]
+            for rec in pair_set.PairValueRecord:
+                if rec.SecondGlyph == second:
+                    return rec
+
+
+def test_layout_records():
+    layout = Layout(TTFont(mavenpro_original), "GPOS")
+    records = layout.records(("latn", "dflt", "kern"))
+    # the kern lookup ignores marks
+    assert records[("pair", "A", "V", "IgnoreMarks")] == ("-75", "0")
+
+
+def test_layout_diff_same():
+    diff = LayoutDiff(TTFont(mavenpro_original), TTFont(mavenpro_original))
+    assert diff.diff == {}
+    assert diff.changed_glyphs == set()
+
+
+def test_layout_diff_kern():
+    font_a = TTFont(mavenpro_original)
+    font_b = TTFont(mavenpro_original)
+    _pair(font_b, "A", "V").Value1.XAdvance = -50
+    diff = LayoutDiff(font_a, font_b)
+    assert diff.diff["GPOS"]["latn/dflt/kern"] == {
+        "pair A V IgnoreMarks": ["-75 0", "-50 0"]
+    }
+    assert "GSUB" not in diff.diff
+    assert diff.changed_glyphs == {"A", "V"}
+
+
+def test_layout_diff_sub():
+    font_a = TTFont(mavenpro_original)
+    font_b = TTFont(mavenpro_original)
+    font_b["GSUB"].table.LookupList.Lookup[0].SubTable[0].mapping["A"] = "B"
+    diff = LayoutDiff(font_a, font_b)
+    assert diff.diff["GSUB"]["latn/dflt/aalt"] == {"single A": ["ordfeminine", "B"]}
+    assert diff.changed_glyphs == {"A", "B", "ordfeminine"}
+
+
+def test_layout_diff_cache(tmp_path, monkeypatch):
+    from diffenator2.cache import DiskCache
+    cache = DiskCache(str(tmp_path / "cache.sqlite"))
+    font_a = TTFont(mavenpro_original)
+    font_b = TTFont(mavenpro_original)
+    _pair(font_b, "A", "V").Value1.XAdvance = -50
+    diff = LayoutDiff(font_a, font_b, cache=cache)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("table was diffed")
+
+    monkeypatch.setattr(LayoutDiff, "_diff_table", fail)
+    cached = LayoutDiff(font_a, font_b, cache=cache)
+    assert cached.diff == diff.diff
+    assert cached.changed_glyphs == {"A", "V"}
+
+
+def test_layout_diff_lookup_flag():
+    font_a = TTFont(mavenpro_original)
+    font_b = TTFont(mavenpro_original)
+    font_b["GPOS"].table.LookupList.Lookup[0].LookupFlag = 0
+    diff = LayoutDiff(font_a, font_b)
+    assert diff.diff["GPOS"]
+    assert {"A", "V", "T", "o"} <= diff.changed_glyphs
+
+
+def _stack_kern_lookup(ttFont):
+    """Add a copy of the kern lookup to the kern features"""
+    import copy
+    table = ttFont["GPOS"].table
+    table.LookupList.Lookup.append(copy.deepcopy(table.LookupList.Lookup[0]))
+    table.LookupList.LookupCount += 1
+    idx = len(table.LookupList.Lookup) - 1
+    for rec in table.FeatureList.FeatureRecord:
+        if rec.FeatureTag == "kern":
+            rec.Feature.LookupListIndex.append(idx)
+    return table.LookupList.Lookup[idx]
+
+
+def test_layout_diff_stacked_lookups():
+    font_a = TTFont(mavenpro_original)
+    font_b = TTFont(mavenpro_original)
+    _stack_kern_lookup(font_a)
+    lookup = _stack_kern_lookup(font_b)
+    records = Layout(font_a, "GPOS").records(("latn", "dflt", "kern"))
+    assert records[("pair", "A", "V", "IgnoreMarks")] == (("-75", "0"), ("-75", "0"))
+    # values in later lookups add to the first lookup's values
+    for st in lookup.SubTable:
+        if st.Format == 1 and "A" in st.Coverage.glyphs:
+            pair_set = st.PairSet[st.Coverage.glyphs.index("A")]
+            for rec in pair_set.PairValueRecord:
+                if rec.SecondGlyph == "V":
+                    rec.Value1.XAdvance = -50
+    diff = LayoutDiff(font_a, font_b)
+    assert diff.diff["GPOS"]["latn/dflt/kern"] == {
+        "pair A V IgnoreMarks": ["-75 0 + -75 0", "-75 0 + -50 0"]
+    }
+    assert diff.changed_glyphs == {"A", "V"}
+
+
+def _add_context_pos(ttFont):
+    """Add a ContextPos (GPOS type 7) lookup to the kern features"""
+    from fontTools.ttLib.tables import otTables
+    table = ttFont["GPOS"].table
+
+    def coverage(glyph):
+        cov = otTables.Coverage()
+        cov.glyphs = [glyph]
+        return cov
+
+    record = otTables.PosLookupRecord()
+    record.SequenceIndex = 0
+    record.LookupListIndex = 0
+    st = otTables.ContextPos()
+    st.Format = 3
+    st.GlyphCount = 2
+    st.Coverage = [coverage("A"), coverage("V")]
+    st.PosCount = 1
+    st.PosLookupRecord = [record]
+    lookup = otTables.Lookup()
+    lookup.LookupType = 7
+    lookup.LookupFlag = 0
+    lookup.SubTable = [st]
+    lookup.SubTableCount = 1
+    table.LookupList.Lookup.append(lookup)
+    table.LookupList.LookupCount += 1
+    for rec in table.FeatureList.FeatureRecord:
+        if rec.FeatureTag == "kern":
+            rec.Feature.LookupListIndex.append(len(table.LookupList.Lookup) - 1)
+
+
+def test_layout_diff_context_pos(tmp_path):
+    # GPOS type 7 is a contextual lookup, not an extension like GSUB type 7
+    ttFont = TTFont(mavenpro_original)
+    _add_context_pos(ttFont)
+    fp = str(tmp_path / "context.ttf")
+    ttFont.save(fp)
+    font_a = TTFont(fp)
+    font_b = TTFont(fp)
+    _pair(font_b, "A", "V").Value1.XAdvance = -50
+    diff = LayoutDiff(font_a, font_b)
+    assert diff.diff["GPOS"]["latn/dflt/kern"] == {
+        "pair A V IgnoreMarks": ["-75 0", "-50 0"]
+    }
+    assert Layout(font_a, "GPOS").lookup_flags()[-1] is None
+
+
+def test_substitution_sources():
+    sources = substitution_sources(TTFont(mavenpro_original))
+    assert sources["ordfeminine"] == {"a", "A"}
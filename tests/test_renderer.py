@@ -0,0 +1,169 @@
+import pytest
+import numpy as np
+from . import *
+from diffenator2.font import DFont
+from diffenator2.renderer import Renderer
+
+
+def _color_font(fp):
+    """A COLR font whose glyphs are half transparent squares. "A" and "B"
+    overlap by half their width."""
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+    from fontTools.ttLib.tables import otTables
+    from fontTools.colorLib.builder import buildCOLR, buildCPAL
+
+    def square(x0, x1):
+        pen = TTGlyphPen(None)
+        pen.moveTo((x0, 0))
+        pen.lineTo((x0, 600))
+        pen.lineTo((x1, 600))
+        pen.lineTo((x1, 0))
+        pen.closePath()
+        return pen.glyph()
+
+    glyph_order = [".notdef", "A", "B", "A.layer", "B.layer"]
+    fb = FontBuilder(1000, isTTF=True)
+    fb.setupGlyphOrder(glyph_order)
+    fb.setupCharacterMap({ord("A"): "A", ord("B"): "B"})
+    glyphs = {name: square(0, 600) for name in glyph_order}
+    fb.setupGlyf(glyphs)
+    fb.setupHorizontalMetrics({name: (300, 0) for name in glyph_order})
+    fb.setupHorizontalHeader(ascent=800, descent=-200)
+    fb.setupNameTable({"familyName": "Color", "styleName": "Regular"})
+    fb.setupOS2()
+    fb.setupPost()
+    fb.font["CPAL"] = buildCPAL([[(1.0, 0.0, 0.0, 0.5), (0.0, 0.0, 1.0, 0.5)]])
+    fb.font["COLR"] = buildCOLR({"A": [("A.layer", 0)], "B": [("B.layer", 1)]})
+    fb.save(fp)
+    return fp
+
+
+@pytest.mark.parametrize(
+    "fp, text",
+    [
+        (mavenpro_original, "Hamburgefonstiv"),
+        (commissioner_vf, "AVAVA fi"),
+        (kablammo_vf, "an tan"),
+        (None, "ABBA"),
+    ]
+)
+def test_render_text_atlas_matches_cairo(tmp_path, fp, text):
+    if fp is None:
+        fp = _color_font(str(tmp_path / "color.ttf"))
+    font = DFont(fp)
+    renderer = Renderer(font, font_size=28, margin=0)
+    img_cairo, left_cairo = renderer.render_text_cairo(text)
+    img_atlas, left_atlas = renderer.render_text_atlas(text)
+    assert img_cairo.size == img_atlas.size
+    assert left_cairo == left_atlas
+    diff = np.abs(np.asarray(img_cairo, dtype=int) - np.asarray(img_atlas, dtype=int))
+    # glyphs are positioned to the nearest subpixel step
+    assert np.mean(diff) < 0.2
+
+
+def test_render_text_atlas_reuses_glyphs():
+    font = DFont(mavenpro_vf)
+    Renderer(font, font_size=28, margin=0).render("an tan")
+    cached = len(font.glyph_cache)
+    assert cached > 0
+    # glyph tiles are shared between renderers for the same font
+    Renderer(font, font_size=28, margin=0).render("an tan")
+    assert len(font.glyph_cache) == cached
+
+
+@pytest.mark.parametrize(
+    "fp, expected",
+    [
+        (mavenpro_vf, "freetype"),
+        (commissioner_vf, "freetype"),
+    ]
+)
+def test_pick_backend(fp, expected):
+    from diffenator2.renderer import pick_backend
+
+    assert pick_backend(DFont(fp)) == expected
+
+
+def test_pixel_differ_color_font(tmp_path):
+    from diffenator2.renderer import PixelDiffer
+
+    font = DFont(_color_font(str(tmp_path / "color.ttf")))
+    differ = PixelDiffer(font, font)
+    assert differ.renderer == "skia"
+    assert differ.diff("AB") == (0, None)
+
+
+@pytest.mark.parametrize(
+    "fp, text",
+    [
+        (mavenpro_original, "Hamburgefonstiv"),
+        (mavenpro_original, "AVAVA fi"),
+    ]
+)
+def test_render_text_ft_matches_skia(fp, text):
+    font = DFont(fp)
+    img_skia, _ = Renderer(font, font_size=28, margin=0, backend="skia").render(text)
+    img_ft, _ = Renderer(font, font_size=28, margin=0, backend="freetype").render(text)
+    assert img_skia.size == img_ft.size
+    diff = np.abs(np.asarray(img_skia, dtype=int) - np.asarray(img_ft, dtype=int))
+    assert np.mean(diff) < 0.5
+
+
+def test_renderer_location():
+    font = DFont(commissioner_vf)
+    renderer = Renderer(font, font_size=28, margin=0, backend="skia")
+    light, _ = renderer.render("an tan")
+    renderer.set_variations({"wght": 900})
+    heavy, _ = renderer.render("an tan")
+    assert font.variations == {"wght": 900}
+    # a renderer set up at the same location draws the same image
+    same, _ = Renderer(
+        font, font_size=28, margin=0, backend="skia", variations={"wght": 900}
+    ).render("an tan")
+    assert np.array_equal(np.asarray(heavy), np.asarray(same))
+    assert not np.array_equal(np.asarray(light), np.asarray(heavy))
+
+
+def test_shape_reuses_buffer():
+    renderer = Renderer(DFont(mavenpro_vf))
+    buf = renderer.shape("an")
+    assert len(buf.glyph_infos) == 2
+    assert renderer.shape("tant") is buf
+    assert len(buf.glyph_infos) == 4
+
+
+def test_pixel_differ_diff(tmp_path):
+    from diffenator2.renderer import PixelDiffer
+
+    differ = PixelDiffer(DFont(mavenpro_vf), DFont(mavenpro_vf_mod))
+    assert differ.diff("t") == (0, None)
+    pc, box = differ.diff("a")
+    assert pc > 0
+    left, top, right, bottom = box
+    assert 0 <= left < right and 0 <= top < bottom
+    # the images are drawn again when they're needed
+    assert not hasattr(differ, "img_a")
+    differ.debug_gif(str(tmp_path / "a.gif"))
+    assert (tmp_path / "a.gif").exists()
+    assert (tmp_path / "a_diff.png").exists()
+
+
+@pytest.mark.parametrize("text", ["a", "an tan", "Hamburgefonstiv"])
+def test_pixel_differ_diff_symmetric(text):
+    from diffenator2.renderer import PixelDiffer
+
+    font_a, font_b = DFont(mavenpro_vf), DFont(mavenpro_extra_bold)
+    pc_ab, box_ab = PixelDiffer(font_a, font_b).diff(text)
+    pc_ba, box_ba = PixelDiffer(font_b, font_a).diff(text)
+    assert pc_ab == pc_ba > 0
+    assert box_ab == box_ba
+
+
+def test_same_drawing():
+    from diffenator2.renderer import PixelDiffer, same_drawing
+
+    differ = PixelDiffer(DFont(mavenpro_vf), DFont(mavenpro_vf_mod))
+    assert same_drawing(*differ.draw("tn"))
+    assert not same_drawing(*differ.draw("an"))
+    assert same_drawing(None, None)
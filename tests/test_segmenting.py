@@ -0,0 +1,56 @@
+import pytest
+from diffenator2.segmenting import textSegments
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("hello", ([("hello", "Latn", 0, 0)], 0)),
+        ("hello мир", ([("hello ", "Latn", 0, 0), ("мир", "Cyrl", 0, 6)], 0)),
+        ("abc مرحبا", ([("abc ", "Latn", 0, 0), ("مرحبا", "Arab", 1, 4)], 0)),
+        ("مرحبا ١٢", ([("مرحبا ", "Arab", 1, 0), ("١٢", "Arab", 2, 6)], 1)),
+        # explicit embeddings raise the level of left to right text
+        ("a‫b", ([("a‫", "Latn", 0, 0), ("b", "Latn", 2, 2)], 0)),
+        ("", ([], 0)),
+    ]
+)
+def test_text_segments(text, expected):
+    assert textSegments(text) == expected
+    # right to left results are cached, make sure they aren't shared
+    textSegments(text)[0].append(None)
+    assert textSegments(text) == expected
+
+
+def test_segment_arrays():
+    from diffenator2.segmenting import SCRIPTS, segmentArrays
+
+    texts = ["hello мир", "", "abc مرحبا", "a‫b", "́(x)"]
+    codepoints = [ord(c) for c in "".join(texts)]
+    offsets = [0]
+    for text in texts:
+        offsets.append(offsets[-1] + len(text))
+    seg_offsets, starts, levels, scripts = segmentArrays(codepoints, offsets)
+    for i, text in enumerate(texts):
+        segments = textSegments(text)[0]
+        a, b = seg_offsets[i], seg_offsets[i + 1]
+        assert list(starts[a:b]) == [s[3] for s in segments]
+        assert list(levels[a:b]) == [s[2] for s in segments]
+        assert [SCRIPTS[s] for s in scripts[a:b]] == [s[1] for s in segments]
+
+
+def test_unicode_tables(tmp_path, monkeypatch):
+    import numpy as np
+    from diffenator2 import segmenting
+
+    # the shipped tables are up to date and match unicodedata2
+    tables = segmenting._loadUnicodeTables()
+    assert tables is not None
+    for shipped, scanned in zip(tables, segmenting._scanUnicode()):
+        assert np.array_equal(shipped, scanned)
+    # stale tables aren't used
+    fp = tmp_path / "unicode_tables.json"
+    segmenting.compile_unicode_tables(str(fp))
+    monkeypatch.setattr(segmenting, "UNICODE_TABLES", str(fp))
+    assert segmenting._loadUnicodeTables() is not None
+    monkeypatch.setattr(segmenting.unicodedata2, "unidata_version", "1.0.0")
+    assert segmenting._loadUnicodeTables() is None
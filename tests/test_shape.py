@@ -0,0 +1,217 @@
+import pytest
+import tempfile
+from . import *
+from diffenator2.font import DFont
+from diffenator2.renderer import Renderer
+
+
+@pytest.mark.parametrize(
+    "fp_a, fp_b, text, expected",
+    [
+        (mavenpro_vf, mavenpro_vf, "an tan", True),
+        (mavenpro_vf, mavenpro_vf_mod, "tn", True),
+        (mavenpro_vf, mavenpro_vf_mod, "an tan", False),
+    ]
+)
+def test_same_glyph_run(fp_a, fp_b, text, expected):
+    from diffenator2.shape import same_glyph_run
+
+    font_a = DFont(fp_a)
+    font_b = DFont(fp_b)
+    buf_a = Renderer(font_a).shape(text)
+    buf_b = Renderer(font_b).shape(text)
+    assert same_glyph_run(font_a, buf_a, font_b, buf_b) == expected
+
+
+@pytest.mark.parametrize(
+    "fp_a, fp_b, expected",
+    [
+        (mavenpro_vf, mavenpro_vf, set()),
+        (mavenpro_vf, mavenpro_vf_mod, {"an", "tant"}),
+    ]
+)
+def test_test_words(fp_a, fp_b, expected):
+    from diffenator2.shape import test_words
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf8") as doc:
+        doc.write("\n".join(["tn", "an", "nan", "tant"]))
+        doc.flush()
+        words = test_words(doc.name, DFont(fp_a), DFont(fp_b), threshold=0.0001)
+    assert set(w.string for w in words) == expected
+
+
+@pytest.mark.parametrize(
+    "characters, expected",
+    [
+        ({"a"}, {"an", "tant"}),
+        ({"t"}, {"tant"}),
+        (set(), set()),
+    ]
+)
+def test_test_words_characters(characters, expected):
+    from diffenator2.shape import test_words
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf8") as doc:
+        doc.write("\n".join(["tn", "an", "nan", "tant"]))
+        doc.flush()
+        words = test_words(
+            doc.name,
+            DFont(mavenpro_vf),
+            DFont(mavenpro_vf_mod),
+            threshold=0.0001,
+            characters=characters,
+        )
+    assert set(w.string for w in words) == expected
+
+
+@pytest.mark.parametrize(
+    "fp_a, fp_b, expected",
+    [
+        (mavenpro_vf, mavenpro_vf, set()),
+        (mavenpro_vf, mavenpro_vf_mod, {"a"}),
+        # different fonts may change anything
+        (mavenpro_original, mavenpro_extra_bold, None),
+    ]
+)
+def test_changed_characters(fp_a, fp_b, expected):
+    from diffenator2.shape import changed_characters
+
+    assert changed_characters(DFont(fp_a), DFont(fp_b)) == expected
+
+
+def test_changed_characters_lookup_flag(tmp_path):
+    from fontTools.ttLib import TTFont
+    from diffenator2.shape import changed_characters
+
+    ttFont = TTFont(mavenpro_original)
+    # the kern lookup no longer skips marks
+    ttFont["GPOS"].table.LookupList.Lookup[0].LookupFlag = 0
+    fp = str(tmp_path / "flag.ttf")
+    ttFont.save(fp)
+    font_a, font_b = DFont(mavenpro_original), DFont(fp)
+    advances = [
+        [p.x_advance for p in Renderer(font).shape("T\u0308o").glyph_positions]
+        for font in (font_a, font_b)
+    ]
+    assert advances[0] != advances[1]
+    assert changed_characters(font_a, font_b) is None
+
+
+def test_unshapeable():
+    from diffenator2.shape import unshapeable
+
+    cmap = {ord("a"): "a", ord("e"): "e"}
+    # U+00E9 decomposes, U+0301 may compose and U+200D is ignorable
+    codepoints = [ord(c) for c in "aebé\u0301\u200d("]
+    assert unshapeable(codepoints, cmap) == {ord("b")}
+
+
+@pytest.mark.parametrize(
+    "words, threshold",
+    [
+        (["tn", "an", "nan", "tant", "ant", "tan"], 0.0001),
+        # words below the threshold mark their glyphs as seen in every chunk
+        (["an", "tant", "nat", "ant", "a", "ta", "na", "tan", "aaa", "ttaa", "anna", "t a n"], 8),
+    ]
+)
+@pytest.mark.parametrize("jobs", [2, 3])
+def test_test_words_jobs(words, threshold, jobs):
+    from diffenator2.shape import test_words
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf8") as doc:
+        doc.write("\n".join(words))
+        doc.flush()
+        font_a, font_b = DFont(mavenpro_vf), DFont(mavenpro_vf_mod)
+        font_a.set_variations({"wght": 700})
+        font_b.set_variations({"wght": 700})
+        results = []
+        for j in (1, jobs):
+            stages = {}
+            res = test_words(doc.name, font_a, font_b, threshold=threshold, jobs=j, stages=stages)
+            results.append(([(w.string, w.changed_pixels) for w in res], stages))
+    assert results[0] == results[1]
+
+
+def test_test_words_default_threshold(tmp_path):
+    from fontTools.ttLib import TTFont
+    from diffenator2.shape import test_words
+
+    # move the top half of "α" and "o" right by 12 units
+    ttFont = TTFont(commissioner_vf)
+    cmap = ttFont.getBestCmap()
+    glyf = ttFont["glyf"]
+    for u in (ord("α"), ord("o")):
+        glyph = glyf[cmap[u]]
+        glyph.expand(glyf)
+        coords = glyph.coordinates
+        for i, (x, y) in enumerate(coords):
+            if y > 200:
+                coords[i] = (x + 12, y)
+    fp = str(tmp_path / "mod.ttf")
+    ttFont.save(fp)
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf8") as doc:
+        doc.write("\n".join(["Άαλλαα", "Ӧлӧргӧ", "Βγ"]))
+        doc.flush()
+        words = test_words(doc.name, DFont(commissioner_vf), DFont(fp))
+    assert [w.string for w in words] == ["Άαλλαα", "Ӧлӧргӧ"]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_test_font_glyphs(jobs):
+    from diffenator2.shape import test_font_glyphs
+
+    glyphs = test_font_glyphs(
+        DFont(mavenpro_vf), DFont(mavenpro_vf_mod), threshold=0.0001, jobs=jobs
+    )
+    assert [g.string for g in glyphs.modified] == ["a"]
+    assert glyphs.modified[0].changed_box is not None
+    assert glyphs.stages["above threshold"] == 1
+    assert sum(glyphs.stages.values()) == len(DFont(mavenpro_vf).ttFont.getBestCmap())
+    assert glyphs.missing == glyphs.new == []
+
+
+def test_test_words_stages():
+    from diffenator2.shape import test_words, WORD_STAGES
+
+    stages = {}
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf8") as doc:
+        doc.write("\n".join(["tn", "an", "nan", "tant"]))
+        doc.flush()
+        test_words(
+            doc.name, DFont(mavenpro_vf), DFont(mavenpro_vf_mod), threshold=0.0001, stages=stages
+        )
+    assert list(stages) == list(WORD_STAGES)
+    # "tn" has the same glyphs, "nan" only uses glyphs seen in "an"
+    assert stages["same glyph runs"] == 1
+    assert stages["seen glyphs"] == 1
+    assert stages["above threshold"] == 2
+
+
+def test_test_font_glyphs_cached_results(tmp_path):
+    from diffenator2.shape import test_font_glyphs
+    from diffenator2.cache import DiskCache
+
+    def diff_fonts():
+        disk = DiskCache(str(tmp_path / "cache.sqlite"))
+        font_a, font_b = DFont(mavenpro_vf), DFont(mavenpro_vf_mod)
+        font_a.set_disk_cache(disk)
+        font_b.set_disk_cache(disk)
+        glyphs = test_font_glyphs(font_a, font_b, threshold=0.0001)
+        disk.close()
+        return glyphs
+
+    first = diff_fonts()
+    assert first.stages["cached results"] == 0
+    # a rerun only diffs items whose glyphs or positions have changed
+    second = diff_fonts()
+    assert second.stages["cached results"] == first.stages["above threshold"] + first.stages["below threshold"]
+    assert [(g.string, g.changed_box) for g in second.modified] == [
+        (g.string, g.changed_box) for g in first.modified
+    ]
+
+
+def test_parse_wordlist_import():
+    from diffenator2.shape import parse_wordlist
+    from diffenator2 import wordlist
+
+    assert parse_wordlist is wordlist.parse_wordlist
@@ -58,4 +58,64 @@ def test_re_filter_glyphs(fp, pattern, expected):
     from diffenator2.utils import re_filter_characters
     from diffenator2.font import DFont
     font = DFont(fp)
-    assert re_filter_characters(font, pattern) == expected
\ No newline at end of file
+    assert re_filter_characters(font, pattern) == expected
+
+def test_content_hash():
+    from diffenator2.utils import content_hash
+    with tempfile.TemporaryDirectory() as tmp:
+        fp = os.path.join(tmp, "font.ttf")
+        with open(fp, "wb") as doc:
+            doc.write(b"a")
+        before = content_hash({"coords": "wght=400"}, [fp])
+        assert content_hash({"coords": "wght=400"}, [fp]) == before
+        assert content_hash({"coords": "wght=700"}, [fp]) != before
+        with open(fp, "wb") as doc:
+            doc.write(b"b")
+        os.utime(fp, (0, 0))
+        assert content_hash({"coords": "wght=400"}, [fp]) != before
+
+
+def test_stamp_is_valid(tmp_path):
+    from diffenator2.utils import write_stamp, stamp_is_valid
+    report = tmp_path / "Regular-diffenator.html"
+    report.write_text("report")
+    stamp = str(tmp_path / ".diffenator2" / "diffenator-Regular.1234")
+    assert not stamp_is_valid(stamp)
+    write_stamp(stamp, [str(report)])
+    assert stamp_is_valid(stamp)
+    report.unlink()
+    assert not stamp_is_valid(stamp)
+
+
+def test_input_files_include_source():
+    import diffenator2
+    from diffenator2 import InProcessBuilder
+    builder = InProcessBuilder({"out": "out"})
+    files = builder._input_files({"old_font": mavenpro_vf, "new_font": mavenpro_vf_mod})
+    assert os.path.abspath(diffenator2.__file__) in files
+
+
+def test_screenshot_files_only_given_reports(tmp_path, monkeypatch):
+    from diffenator2 import screenshot
+
+    class FakeScreenShotter:
+        def take(self, url, dst_dir):
+            with open(os.path.join(dst_dir, "browser.png"), "w") as doc:
+                doc.write(url)
+
+    monkeypatch.setattr(screenshot, "ScreenShotter", FakeScreenShotter)
+    ours = tmp_path / "Regular" / "diffbrowsers_glyphs.html"
+    theirs = tmp_path / "Bold" / "diffbrowsers_glyphs.html"
+    for fp in (ours, theirs):
+        fp.parent.mkdir()
+        fp.write_text("report")
+    imgs_out = str(tmp_path / "imgs")
+    images = screenshot.screenshot_files(
+        [str(ours), str(tmp_path / "Regular" / "diffenator.html")],
+        str(tmp_path),
+        imgs_out,
+    )
+    assert images == [
+        os.path.join(imgs_out, "Regular-diffbrowsers_glyphs-browser.png")
+    ]
+    assert os.listdir(imgs_out) == ["Regular-diffbrowsers_glyphs-browser.png"]
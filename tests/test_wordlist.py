@@ -0,0 +1,62 @@
+import os
+import pickle
+import pytest
+import tempfile
+from diffenator2.segmenting import textSegments
+from diffenator2.wordlist import Wordlist, compile_wordlist, index_path, parse_wordlist
+
+
+WORDS = ["tn", "an,latn,dflt,smcp", "مرحبا world", "𞤀𞤁", "", "tant"]
+
+
+@pytest.fixture
+def wordlist():
+    with tempfile.TemporaryDirectory() as tmp:
+        fp = os.path.join(tmp, "words.txt")
+        with open(fp, "w", encoding="utf8") as doc:
+            doc.write("\n".join(WORDS))
+        yield fp
+
+
+@pytest.mark.parametrize("compiled", [False, True])
+def test_wordlist(wordlist, compiled):
+    if compiled:
+        compile_wordlist(wordlist)
+    words = Wordlist(wordlist)
+    assert list(words) == parse_wordlist(wordlist)
+    assert words[1].ot_features == {"smcp": True}
+    for i, (word, segments) in enumerate(words.items()):
+        assert segments == textSegments(word.string)[0]
+
+
+def test_wordlist_stale_index(wordlist):
+    compile_wordlist(wordlist)
+    with open(wordlist, "a", encoding="utf8") as doc:
+        doc.write("\nnan")
+    os.utime(wordlist, (0, 0))
+    words = Wordlist(wordlist)
+    assert words[len(words) - 1].string == "nan"
+
+
+def test_wordlist_select(wordlist):
+    compile_wordlist(wordlist)
+    words = Wordlist(wordlist)
+    assert [w.string for w in words.select({"a", "w", "𞤁"})] == [
+        "an", "مرحبا world", "𞤀𞤁", "tant"
+    ]
+    view = pickle.loads(pickle.dumps(words[3:].select({"t"})))
+    assert [w.string for w in view] == ["tant"]
+    assert os.path.exists(index_path(wordlist))
+
+
+@pytest.mark.parametrize("compiled", [False, True])
+def test_wordlist_without(wordlist, compiled):
+    if compiled:
+        compile_wordlist(wordlist)
+    words = Wordlist(wordlist).without({ord("ب"), ord("𞤁")})
+    segments = {w.string: [s[0] for s in segments] for w, segments in words.items()}
+    assert segments["مرحبا world"] == ["world"]
+    assert segments["tn"] == ["tn"]
+    assert "𞤀𞤁" not in segments
+    view = pickle.loads(pickle.dumps(words[1:]))
+    assert [s[0] for s in view.segments(2)] == ["world"]